@@ -81,7 +81,8 @@ def run_migrations_online():
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
-            compare_type=True
+            compare_type=True,
+            transaction_per_migration=True
         )
 
         with context.begin_transaction():
@@ -0,0 +1,148 @@
+"""partition cell table by sample_id
+
+Revision ID: 4
+Revises: 3
+Create Date: 2026-10-17 10:12:36.518204
+
+Cells are copied in batches committed one by one, outside of the
+migration transaction. If interrupted, running the migration again
+resumes the copy.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '4'
+down_revision = '3'
+branch_labels = None
+depends_on = None
+
+# number of cells moved per statement
+BATCH_SIZE = 100000
+
+CELL_COLUMNS = [
+    'id', 'sample_id', 'sample_cell_id', 'entry_at', 'features', 'area',
+    'column_centroid', 'eccentricity', 'extent', 'major_axis_length',
+    'minor_axis_length', 'orientation', 'row_centroid', 'solidity',
+    'x_centroid', 'y_centroid']
+
+
+def cell_columns():
+    return [
+        sa.Column('id', sa.Integer(),
+                  server_default=sa.text("nextval('cell_id_seq'::regclass)"),
+                  nullable=False),
+        sa.Column('sample_id', sa.Integer(), nullable=False),
+        sa.Column('sample_cell_id', sa.Integer(), nullable=True),
+        sa.Column('entry_at', sa.DateTime(timezone=True),
+                  server_default=sa.func.now(), nullable=True),
+        sa.Column('features', postgresql.JSONB(astext_type=sa.Text()),
+                  nullable=True),
+        sa.Column('area', sa.Numeric(precision=15, scale=4), nullable=True),
+        sa.Column('column_centroid', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+        sa.Column('eccentricity', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+        sa.Column('extent', sa.Numeric(precision=15, scale=4), nullable=True),
+        sa.Column('major_axis_length', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+        sa.Column('minor_axis_length', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+        sa.Column('orientation', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+        sa.Column('row_centroid', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+        sa.Column('solidity', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+        sa.Column('x_centroid', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+        sa.Column('y_centroid', sa.Numeric(precision=15, scale=4),
+                  nullable=True),
+    ]
+
+
+def has_table(name):
+    conn = op.get_bind()
+    return conn.execute(sa.text("SELECT to_regclass(:name) IS NOT NULL"),
+                        name=name).scalar()
+
+
+def move_cells(source, target):
+    """ Copy all rows from `source` into `target` in batches of id range,
+    each committed on its own, so no transaction holds the whole table.
+    Batches are copied in the order of id, so an interrupted copy is
+    resumed after the max id in `target`.
+    """
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        lo, hi = conn.execute(
+            sa.text("SELECT min(id), max(id) FROM %s" % source)).fetchone()
+        if lo is None:
+            return
+        done = conn.execute(
+            sa.text("SELECT max(id) FROM %s" % target)).scalar()
+        if done is not None:
+            lo = done + 1
+        columns = ', '.join(CELL_COLUMNS)
+        sql = sa.text("INSERT INTO %s (%s) SELECT %s FROM %s "
+                      "WHERE id >= :lo AND id < :hi"
+                      % (target, columns, columns, source))
+        for start in range(lo, hi + 1, BATCH_SIZE):
+            conn.execute(sql, lo=start, hi=start + BATCH_SIZE)
+
+
+def upgrade():
+    # resume an interrupted copy
+    if has_table('cell_old'):
+        move_cells('cell_old', 'cell')
+        op.drop_table('cell_old')
+        return
+
+    op.rename_table('cell', 'cell_old')
+    op.execute('ALTER TABLE cell_old RENAME CONSTRAINT cell_pkey '
+               'TO cell_old_pkey')
+    op.drop_constraint('cell_sample_id_fkey', 'cell_old', type_='foreignkey')
+
+    op.create_table(
+        'cell',
+        *cell_columns(),
+        sa.PrimaryKeyConstraint('id', 'sample_id'),
+        postgresql_partition_by='LIST (sample_id)'
+    )
+    op.execute('ALTER SEQUENCE cell_id_seq OWNED BY cell.id')
+
+    conn = op.get_bind()
+    sample_ids = conn.execute(sa.text("SELECT id FROM sample ORDER BY id"))
+    for sample_id, in sample_ids.fetchall():
+        op.execute('CREATE TABLE cell_sample_%d PARTITION OF cell '
+                   'FOR VALUES IN (%d)' % (sample_id, sample_id))
+
+    move_cells('cell_old', 'cell')
+    op.drop_table('cell_old')
+
+
+def downgrade():
+    # resume an interrupted copy
+    if has_table('cell_partitioned'):
+        move_cells('cell_partitioned', 'cell')
+        op.drop_table('cell_partitioned')
+        return
+
+    op.rename_table('cell', 'cell_partitioned')
+    op.execute('ALTER TABLE cell_partitioned RENAME CONSTRAINT cell_pkey '
+               'TO cell_partitioned_pkey')
+
+    op.create_table(
+        'cell',
+        *cell_columns(),
+        sa.ForeignKeyConstraint(['sample_id'], ['sample.id'],
+                                name='cell_sample_id_fkey',
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('ALTER SEQUENCE cell_id_seq OWNED BY cell.id')
+
+    move_cells('cell_partitioned', 'cell')
+    # drops all the partitions as well
+    op.drop_table('cell_partitioned')
@@ -0,0 +1,62 @@
+"""add cell sample_cell_id index
+
+Revision ID: 5
+Revises: 4
+Create Date: 2026-10-17 14:03:51.207716
+
+Builds the index on each partition with `CREATE INDEX CONCURRENTLY`, so
+the `cell` table stays writable, and then attaches them to the index on
+the partitioned table.
+
+To make the index unique, which allows per-cell upserts with
+`ON CONFLICT (sample_id, sample_cell_id)`, run:
+
+    alembic -x unique_cell_index=true upgrade head
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5'
+down_revision = '4'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'ix_cell_sample_cell_id'
+# the same as postgres names the index when attaching a partition
+PARTITION_INDEX_NAME = '%s_sample_id_sample_cell_id_idx'
+
+
+def is_unique():
+    rval = context.get_x_argument(as_dictionary=True)\
+        .get('unique_cell_index', '')
+    return rval.lower() in ('1', 'true', 'yes')
+
+
+def upgrade():
+    unique = 'UNIQUE ' if is_unique() else ''
+    conn = op.get_bind()
+    partitions = conn.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'cell'::regclass ORDER BY c.relname"))
+    partitions = [x for x, in partitions.fetchall()]
+
+    # invalid until all the partitions are attached
+    op.execute('CREATE %sINDEX IF NOT EXISTS %s '
+               'ON ONLY cell (sample_id, sample_cell_id)'
+               % (unique, INDEX_NAME))
+    with op.get_context().autocommit_block():
+        for name in partitions:
+            op.execute('CREATE %sINDEX CONCURRENTLY IF NOT EXISTS %s '
+                       'ON %s (sample_id, sample_cell_id)'
+                       % (unique, PARTITION_INDEX_NAME % name, name))
+    for name in partitions:
+        op.execute('ALTER INDEX %s ATTACH PARTITION %s'
+                   % (INDEX_NAME, PARTITION_INDEX_NAME % name))
+
+
+def downgrade():
+    # drops the partition indexes as well
+    op.drop_index(INDEX_NAME, table_name='cell')
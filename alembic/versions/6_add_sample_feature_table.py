@@ -0,0 +1,60 @@
+"""add sample_feature table
+
+Revision ID: 6
+Revises: 5
+Create Date: 2026-10-17 16:40:12.093158
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '6'
+down_revision = '5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'sample_feature',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('sample_id', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('db_key', sa.String(), nullable=False),
+        sa.Column('marker_id', sa.Integer(), nullable=False),
+        sa.Column('mask_type', sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(['sample_id'], ['sample.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['marker_id'], ['marker.id'],
+                                onupdate='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sample_feature', 'sample_feature',
+                    ['sample_id', 'position'], unique=True)
+
+    # backfill from the union of keys over all cells of each sample
+    op.execute("""
+        INSERT INTO sample_feature
+            (sample_id, position, db_key, marker_id, mask_type)
+        SELECT k.sample_id,
+               row_number() OVER (PARTITION BY k.sample_id
+                                  ORDER BY k.marker_id, k.db_key) - 1,
+               k.db_key, k.marker_id,
+               CASE split_part(k.db_key, '_', 2)
+                   WHEN 'cl' THEN 'cell_masks'
+                   ELSE 'nuclei_masks' END
+        FROM (
+            SELECT t.sample_id, t.db_key,
+                   split_part(t.db_key, '_', 1)::int AS marker_id
+            FROM (SELECT DISTINCT sample_id,
+                         jsonb_object_keys(features) AS db_key
+                  FROM cell) t
+        ) k
+        JOIN marker m ON m.id = k.marker_id
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_sample_feature', table_name='sample_feature')
+    op.drop_table('sample_feature')
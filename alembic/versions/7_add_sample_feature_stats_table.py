@@ -0,0 +1,94 @@
+"""add sample_feature_stats table
+
+Revision ID: 7
+Revises: 6
+Create Date: 2026-10-17 20:15:42.318604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '7'
+down_revision = '6'
+branch_labels = None
+depends_on = None
+
+# the same as `cycif_db.data_frame._stats`
+SKETCH_ALPHA = 0.01
+MIN_SKETCH_VALUE = 1e-9
+
+
+def upgrade():
+    op.create_table(
+        'sample_feature_stats',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('sample_id', sa.Integer(), nullable=False),
+        sa.Column('db_key', sa.String(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('min', sa.Float(), nullable=True),
+        sa.Column('max', sa.Float(), nullable=True),
+        sa.Column('mean', sa.Float(), nullable=True),
+        sa.Column('m2', sa.Float(), nullable=True),
+        sa.Column('sketch', postgresql.JSONB(astext_type=sa.Text()),
+                  nullable=True),
+        sa.ForeignKeyConstraint(['sample_id'], ['sample.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sample_feature_stats', 'sample_feature_stats',
+                    ['sample_id', 'db_key'], unique=True)
+
+    # backfill from the cells of the manifests, with the sketch buckets
+    # computed in the same way as `Quantile_Sketch`
+    gamma = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+    op.execute(sa.text("""
+        WITH v AS (
+            SELECT f.sample_id, f.db_key,
+                   (c.features ->> f.db_key)::float8 AS value
+            FROM sample_feature f
+            JOIN cell c ON c.sample_id = f.sample_id
+            WHERE c.features ? f.db_key
+              AND jsonb_typeof(c.features -> f.db_key) = 'number'
+        ), stats AS (
+            SELECT sample_id, db_key, count(*) AS count, min(value) AS min,
+                   max(value) AS max, avg(value) AS mean,
+                   var_pop(value) * count(*) AS m2
+            FROM v GROUP BY sample_id, db_key
+        ), buckets AS (
+            SELECT sample_id, db_key,
+                   CASE WHEN abs(value) <= :min_value THEN 'zero'
+                        WHEN value > 0 THEN 'pos' ELSE 'neg' END AS store,
+                   CASE WHEN abs(value) <= :min_value THEN 0
+                        ELSE ceil(ln(abs(value)) / ln(:gamma))::int
+                   END AS bucket,
+                   count(*) AS count
+            FROM v GROUP BY 1, 2, 3, 4
+        ), sketches AS (
+            SELECT sample_id, db_key, jsonb_build_object(
+                'alpha', :alpha,
+                'zero', coalesce(sum(count) FILTER (WHERE store = 'zero'),
+                                 0),
+                'pos', coalesce(jsonb_object_agg(bucket::text, count)
+                                FILTER (WHERE store = 'pos'), '{}'),
+                'neg', coalesce(jsonb_object_agg(bucket::text, count)
+                                FILTER (WHERE store = 'neg'), '{}')
+            ) AS sketch
+            FROM buckets GROUP BY sample_id, db_key
+        )
+        INSERT INTO sample_feature_stats
+            (sample_id, db_key, count, min, max, mean, m2, sketch)
+        SELECT s.sample_id, s.db_key, s.count, s.min, s.max, s.mean, s.m2,
+               k.sketch
+        FROM stats s
+        JOIN sketches k ON k.sample_id = s.sample_id
+            AND k.db_key = s.db_key
+    """).bindparams(alpha=SKETCH_ALPHA, min_value=MIN_SKETCH_VALUE,
+                    gamma=gamma))
+
+
+def downgrade():
+    op.drop_index('ix_sample_feature_stats',
+                  table_name='sample_feature_stats')
+    op.drop_table('sample_feature_stats')
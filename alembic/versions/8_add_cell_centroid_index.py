@@ -0,0 +1,50 @@
+"""add cell centroid index
+
+Revision ID: 8
+Revises: 7
+Create Date: 2026-10-17 21:32:08.564127
+
+Builds a GiST index on `point(x_centroid, y_centroid)` for region
+queries, on each partition with `CREATE INDEX CONCURRENTLY`, so the
+`cell` table stays writable, and then attaches them to the index on the
+partitioned table.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8'
+down_revision = '7'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'ix_cell_centroid'
+# the same as postgres names the index when attaching a partition
+PARTITION_INDEX_NAME = '%s_point_idx'
+
+
+def upgrade():
+    conn = op.get_bind()
+    partitions = conn.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'cell'::regclass ORDER BY c.relname"))
+    partitions = [x for x, in partitions.fetchall()]
+
+    # invalid until all the partitions are attached
+    op.execute('CREATE INDEX IF NOT EXISTS %s ON ONLY cell '
+               'USING gist (point(x_centroid, y_centroid))' % INDEX_NAME)
+    with op.get_context().autocommit_block():
+        for name in partitions:
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s '
+                       'USING gist (point(x_centroid, y_centroid))'
+                       % (PARTITION_INDEX_NAME % name, name))
+    for name in partitions:
+        op.execute('ALTER INDEX %s ATTACH PARTITION %s'
+                   % (INDEX_NAME, PARTITION_INDEX_NAME % name))
+
+
+def downgrade():
+    # drops the partition indexes as well
+    op.drop_index(INDEX_NAME, table_name='cell')
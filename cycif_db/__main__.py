@@ -1,6 +1,7 @@
 import click
 
 from .cyc_session import CycSession
+from .ingest import add_samples_from_dir, summarize_results
 
 
 @click.group()
@@ -19,6 +20,29 @@ def add_sample_complex(ctx):
     pass
 
 
+@main.command('batch_add_sample_complex')
+@click.argument('parent', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', '-w', default=4, show_default=True,
+              help="The maximum number of worker processes.")
+@click.option('--dry_run', is_flag=True, default=False,
+              help="Run without committing.")
+@click.option('--loader', default='orm', show_default=True,
+              type=click.Choice(['orm', 'copy']),
+              help="How cells are inserted into database.")
+@click.option('--pipelined', is_flag=True, default=False,
+              help="Read and transform the next chunks of cells while the "
+                   "current chunk is being inserted.")
+@click.pass_context
+def batch_add_sample_complex(ctx, parent, workers, dry_run, loader,
+                             pipelined):
+    """ Ingest all sample folders under PARENT in parallel processes.
+    """
+    results = add_samples_from_dir(parent, workers=workers,
+                                   dry_run=dry_run, loader=loader,
+                                   pipelined=pipelined)
+    click.echo(summarize_results(results))
+
+
 @main.command('create_db')
 @click.pass_context
 def create_db(ctx):
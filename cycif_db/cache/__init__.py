@@ -0,0 +1,2 @@
+from ._cells_cache import Cells_Cache
+from ._matrix_cache import Matrix_Cache
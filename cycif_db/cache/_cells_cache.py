@@ -0,0 +1,179 @@
+""" Local on-disk cache of cells DataFrames
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+# default size limit of cache, 10 GiB
+MAX_BYTES = 10 * 2 ** 30
+
+
+class Cells_Cache(object):
+    """ A size-bounded LRU cache of cells DataFrames on local disk.
+    DataFrames are stored as Parquet files, and an index of entries,
+    with the samples and the last access time of each entry, is kept in
+    `index.json` in the same folder.
+
+    It's meant for one process at a time. The index is replaced
+    atomically, so a crash never leaves it corrupted.
+
+    Parameters
+    -----------
+    path: str.
+        The cache folder, created if missing.
+    max_bytes: int, default is 10 GiB.
+        The least recently used entries are evicted when the total size
+        of files goes beyond this.
+    """
+    def __init__(self, path, max_bytes=MAX_BYTES) -> None:
+        if not isinstance(max_bytes, int) or max_bytes < 1:
+            raise ValueError("Argument `max_bytes` must be a positive "
+                             "integer!")
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+        self._entries = self._load_index()
+
+    @staticmethod
+    def make_key(params):
+        """ Hash JSON compatible query parameters into a cache key.
+        """
+        data = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    @property
+    def size(self):
+        return sum(x['size'] for x in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """ Load the DataFrame of `key`, or None if it's not cached.
+        """
+        import pyarrow.parquet as pq
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            rval = pq.read_table(
+                os.path.join(self.path, entry['file'])).to_pandas()
+        except (OSError, ValueError):
+            # ArrowInvalid of a corrupt file is a ValueError
+            log.warning("Cache file of `%s` is missing or broken!" % key)
+            self._remove(key)
+            self._save_index()
+            return None
+        entry['atime'] = time.time()
+        self._save_index()
+        log.info("Loaded %d cells from cache `%s`." % (rval.shape[0], key))
+        return rval
+
+    def put(self, key, df, sample_ids):
+        """ Save a DataFrame into cache and evict the least recently used
+        entries beyond `max_bytes`.
+
+        Parameters
+        ----------
+        key: str.
+        df: pandas.DataFrame.
+        sample_ids: list of int.
+            The samples the DataFrame comes from, used by `invalidate`.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if key in self._entries:
+            self._remove(key)
+        filename = '%s-%s.parquet' % (key[:16], uuid.uuid4().hex[:8])
+        file_path = os.path.join(self.path, filename)
+        tmp_path = '%s.%d.tmp' % (file_path, os.getpid())
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                       tmp_path)
+        os.replace(tmp_path, file_path)
+        size = os.path.getsize(file_path)
+        if size > self.max_bytes:
+            os.remove(file_path)
+            log.info("Skipped caching %d bytes, larger than the cache."
+                     % size)
+            return
+
+        self._entries[key] = {
+            'file': filename,
+            'size': size,
+            'sample_ids': sorted(set(int(x) for x in sample_ids)),
+            'atime': time.time(),
+        }
+        self._evict()
+        self._save_index()
+
+    def invalidate(self, sample_ids):
+        """ Remove the entries having any of `sample_ids`.
+
+        Returns
+        -------
+        The number of entries removed.
+        """
+        sample_ids = set(sample_ids)
+        keys = [k for k, v in self._entries.items()
+                if sample_ids.intersection(v['sample_ids'])]
+        for key in keys:
+            self._remove(key)
+        if keys:
+            self._save_index()
+            log.info("Invalidated %d cache entries of samples %s."
+                     % (len(keys), sorted(sample_ids)))
+        return len(keys)
+
+    def clear(self):
+        for key in list(self._entries):
+            self._remove(key)
+        self._save_index()
+
+    def _evict(self):
+        total = self.size
+        for key in sorted(self._entries,
+                          key=lambda x: self._entries[x]['atime']):
+            if total <= self.max_bytes:
+                break
+            total -= self._entries[key]['size']
+            self._remove(key)
+            log.info("Evicted cache entry `%s`." % key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        try:
+            os.remove(os.path.join(self.path, entry['file']))
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {}
+        try:
+            with open(index_path, 'r') as fp:
+                return json.load(fp)
+        except ValueError:
+            log.warning("Cache index `%s` is broken and reset!"
+                        % index_path)
+            return {}
+
+    def _save_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self._entries, fp)
+        os.replace(tmp_path, index_path)
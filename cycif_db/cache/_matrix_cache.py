@@ -0,0 +1,169 @@
+""" Per-sample memory-mapped cache of cell feature matrices
+"""
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shutil
+
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+MATRIX_FILE = 'features.npy'
+IDS_FILE = 'sample_cell_id.npy'
+
+
+class Matrix_Cache(object):
+    """ A cache of the numeric features of whole samples on local disk.
+    Each sample is kept in its own folder, as a float32 `.npy` matrix of
+    the morphology and marker features, an int64 `.npy` of
+    `sample_cell_id` and a JSON manifest of the columns. Matrices are
+    loaded with `numpy.load(mmap_mode='r')`, so opening a sample doesn't
+    read it, and processes loading the same sample share the OS page
+    cache.
+
+    An entry is only valid for the same `entry_at` and feature manifest
+    of the sample. Files are replaced atomically, and the manifest is
+    written last, so readers in other processes never see a partial
+    entry.
+
+    Parameters
+    -----------
+    path: str.
+        The cache folder, created if missing.
+    """
+    def __init__(self, path) -> None:
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def load(self, sample_id, entry_at, db_keys):
+        """ Load the cells of a sample as a read-only DataFrame backed by
+        the memory-mapped matrix, or None if the entry is missing or
+        stale.
+
+        Parameters
+        ----------
+        sample_id: int.
+        entry_at: datetime or None.
+            `entry_at` of the sample.
+        db_keys: list of str.
+            The feature manifest of the sample.
+
+        Returns
+        -------
+        pandas DataFrame, with `sample_cell_id` followed by the float32
+        features.
+        """
+        folder = self._sample_folder(sample_id)
+        try:
+            with open(os.path.join(folder, MANIFEST_FILE), 'r') as fp:
+                manifest = json.load(fp)
+            if manifest['entry_at'] != _isoformat(entry_at) \
+                    or manifest['db_keys'] != sorted(db_keys):
+                log.info("Matrix cache of sample %d is stale." % sample_id)
+                return None
+            matrix = np.load(os.path.join(folder, manifest['matrix']),
+                             mmap_mode='r')
+            ids = np.load(os.path.join(folder, manifest['ids']),
+                          mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None
+        if matrix.shape != (ids.shape[0], len(manifest['columns'])):
+            log.warning("Matrix cache of sample %d is broken!" % sample_id)
+            return None
+
+        rval = pd.DataFrame(matrix, columns=manifest['columns'], copy=False)
+        rval.insert(0, 'sample_cell_id', ids)
+        log.info("Mapped %d cells of sample %d from cache."
+                 % (ids.shape[0], sample_id))
+        return rval
+
+    def save(self, sample_id, entry_at, db_keys, df):
+        """ Save the cells of a sample.
+
+        Parameters
+        ----------
+        sample_id: int.
+        entry_at: datetime or None.
+        db_keys: list of str.
+        df: pandas.DataFrame.
+            All the numeric features of the sample, including
+            `sample_cell_id`.
+
+        Returns
+        -------
+        bool, False if the sample isn't cached because it has cells
+        without `sample_cell_id`.
+        """
+        if df['sample_cell_id'].isna().any():
+            log.info("Sample %d has cells without `sample_cell_id`, not "
+                     "cached." % sample_id)
+            return False
+        folder = self._sample_folder(sample_id)
+        os.makedirs(folder, exist_ok=True)
+        columns = [x for x in df.columns if x != 'sample_cell_id']
+        suffix = '.%d.tmp' % os.getpid()
+
+        # a new file name each time, so readers mapping the old files
+        # keep a consistent entry until they reload
+        version = os.urandom(4).hex()
+        files = {'matrix': '%s-%s' % (version, MATRIX_FILE),
+                 'ids': '%s-%s' % (version, IDS_FILE)}
+        for name, values in (
+                ('matrix', df[columns].to_numpy(dtype='float32')),
+                ('ids', df['sample_cell_id'].to_numpy(dtype='int64'))):
+            file_path = os.path.join(folder, files[name])
+            with open(file_path + suffix, 'wb') as fp:
+                np.save(fp, np.ascontiguousarray(values))
+            os.replace(file_path + suffix, file_path)
+
+        manifest = dict(files, sample_id=sample_id,
+                        entry_at=_isoformat(entry_at),
+                        db_keys=sorted(db_keys), columns=columns)
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+        previous = _read_manifest(manifest_path)
+        with open(manifest_path + suffix, 'w') as fp:
+            json.dump(manifest, fp)
+        os.replace(manifest_path + suffix, manifest_path)
+
+        # remove the files of the replaced version only, those of
+        # concurrent writers are left alone
+        for name in ('matrix', 'ids'):
+            filename = previous.get(name)
+            if not filename or filename == files[name]:
+                continue
+            try:
+                os.remove(os.path.join(folder, filename))
+            except FileNotFoundError:
+                pass
+        log.info("Cached %d cells of sample %d." % (df.shape[0], sample_id))
+        return True
+
+    def invalidate(self, sample_ids):
+        """ Remove the entries of `sample_ids`.
+        """
+        for sample_id in sample_ids:
+            shutil.rmtree(self._sample_folder(sample_id), ignore_errors=True)
+
+    def clear(self):
+        for filename in os.listdir(self.path):
+            if filename.startswith('sample_'):
+                shutil.rmtree(os.path.join(self.path, filename),
+                              ignore_errors=True)
+
+    def _sample_folder(self, sample_id):
+        return os.path.join(self.path, 'sample_%d' % sample_id)
+
+
+def _read_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _isoformat(entry_at):
+    return entry_at.isoformat() if entry_at is not None else None
@@ -1,19 +1,36 @@
 """ Main wrapper class that interacts with cycIF_DB
 """
+import base64
+import itertools
+import json
 import logging
 import pandas as pd
+import random
 import re
+import zlib
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from collections.abc import Iterable
 from pandas import DataFrame
-from sqlalchemy import func
+from sqlalchemy import (and_, BigInteger, bindparam, cast, column, Float,
+                        func, Integer, literal_column, not_, Numeric, or_,
+                        String, text, tuple_)
+from sqlalchemy.dialects.postgresql import ARRAY, array, JSONB
 from sqlalchemy.orm import Session
-from .data_frame import CycDataFrame, get_headers_categorized
+from sqlalchemy.pool import QueuePool
+from .data_frame import (CycDataFrame, encode_features, Feature_Stats,
+                         get_headers_categorized, Quantile_Sketch,
+                         rows_to_frame, to_copy_buffer,
+                         write_parquet_dataset)
 from .markers import format_marker, Marker_Comparator
-from .model import (Cell, Marker, Marker_Alias, Sample,
-                    Sample_Marker_Association)
+from .model import (Cell, Marker, Marker_Alias, Sample, Sample_Feature,
+                    Sample_Feature_Stats, Sample_Marker_Association,
+                    cell_centroid, cell_partition,
+                    cell_partition_name)
 from .model.mapping import OTHER_FEATHERS
-from .utils import engine_maker
+from .query import parse_filter
+from .utils import engine_maker, run_pipeline
 
 
 log = logging.getLogger(__name__)
@@ -24,6 +41,29 @@ HEADER_SUFFIX_MAPPING = {
     '_+(cellpose|cp)[\s_-]*masks([\s_-]*on[\s_-]*data[\s_-]*\d*)*$': '_nu',
 }
 
+CELL_LOADERS = ('orm', 'copy')
+
+CELL_EXPORTERS = ('pandas', 'copy')
+
+# chunksize of streaming export if not specified
+EXPORT_CHUNKSIZE = 100000
+
+MASK_TYPES = {
+    'cl': 'cell_masks',
+    'nu': 'nuclei_masks',
+}
+
+# range of the 64-bit hash used to sample cells
+HASH_MIN = -2 ** 63
+HASH_RANGE = 2 ** 64
+
+# stats supported by `summarize_samples`, besides percentiles like `p25`
+SUMMARY_STATS = ('count', 'mean', 'std', 'min', 'max', 'median')
+
+# detached copy of a `Marker` row, which never expires with commit
+Marker_Record = namedtuple('Marker_Record',
+                           ['id', 'name', 'fluor', 'anti', 'duplicate'])
+
 
 class CycSession(Session):
     """ A sqlalchemy Session subclass
@@ -32,15 +72,31 @@ class CycSession(Session):
     ----------
     bind: `sqlalchemy.engine.Engine` object or other supported
         object, default=None.
+    cells_cache: `cycif_db.cache.Cells_Cache` object or None.
+        If provided, the results of `get_cells_from_samples` are cached
+        on local disk, see `Cells_Cache`.
+    matrix_cache: `cycif_db.cache.Matrix_Cache` object or None.
+        If provided, whole samples loaded by `get_cells_for_sample` with
+        `marker_dtype='float32'` are memory-mapped from local disk, see
+        `Matrix_Cache`.
     kwargs: other keywords parameter for Session
     """
-    def __init__(self, bind=None, **kwargs):
+    def __init__(self, bind=None, cells_cache=None, matrix_cache=None,
+                 **kwargs):
         if not bind:
             engine = engine_maker()
             bind = engine
         super(CycSession, self).__init__(bind=bind, **kwargs)
+        self.cells_cache = cells_cache
+        self.matrix_cache = matrix_cache
         # float precision
         self.decimals = 4
+        # cache of `format_marker(alias): marker_id`
+        self._alias_map = None
+        # cache of `marker_id: Marker_Record` and of Marker_Comparator
+        # objects keyed by marker_id and comparison flags
+        self._marker_map = None
+        self._comparators = {}
 
     def __enter__(self):
         return self
@@ -71,7 +127,8 @@ class CycSession(Session):
             marker, count = re.subn(k, '', header, flags=re.I)
             if count:
                 marker_id = self.get_alias_marker_id(marker)
-                assert marker_id
+                assert marker_id, \
+                    f"No marker alias matches header: `{header}`!"
                 rval = str(marker_id) + v
                 log.info(f"Mapped header `{header}` to `{rval}`!")
                 return rval
@@ -96,10 +153,69 @@ class CycSession(Session):
 
         self.add(sample)
         self.flush()
+        self.create_cell_partition(sample.id)
         log.info("Added sample {}.".format(repr(sample)))
         return sample
 
+    def get_cell_partition_state(self, sample_id):
+        """ Check the `cell` partition of a sample.
+
+        Returns
+        -------
+        None if the partition doesn't exist, 'detached' if it's created
+        but not attached to `cell` yet, otherwise 'attached'.
+        """
+        rval = self.execute(
+            text("SELECT relispartition FROM pg_class "
+                 "WHERE oid = to_regclass(:name)"),
+            {'name': cell_partition_name(sample_id)}).scalar()
+        if rval is None:
+            return None
+        return 'attached' if rval else 'detached'
+
+    def create_cell_partition(self, sample_id):
+        """ Create the `cell` partition of a sample, as a detached
+        table. Cells are loaded into the table directly and the table is
+        attached to `cell` afterwards by `attach_cell_partition`, because
+        creating a partition in place would lock the whole `cell` table
+        for the rest of the transaction.
+
+        The CHECK constraint spares a validation scan at attaching.
+        """
+        if self.get_cell_partition_state(sample_id) is not None:
+            return
+        name = cell_partition_name(sample_id)
+        self.execute(text(
+            "CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS); "
+            "ALTER TABLE {name} ADD CONSTRAINT {name}_sample_id_check "
+            "CHECK (sample_id = {sample_id})".format(
+                name=name, parent=Cell.__tablename__,
+                sample_id=int(sample_id))))
+        log.info("Created cell partition `%s`." % name)
+
+    def attach_cell_partition(self, sample_id):
+        """ Attach the `cell` partition of a sample if it's detached.
+        The primary key index of the partition is built here.
+        """
+        if self.get_cell_partition_state(sample_id) != 'detached':
+            return
+        name = cell_partition_name(sample_id)
+        self.execute(text(
+            "ALTER TABLE {parent} ATTACH PARTITION {name} "
+            "FOR VALUES IN ({sample_id})".format(
+                name=name, parent=Cell.__tablename__,
+                sample_id=int(sample_id))))
+        log.info("Attached cell partition `%s`." % name)
+
+    def drop_cell_partitions(self, sample_ids):
+        """ Drop the `cell` partitions, i.e. all the cells, of samples.
+        """
+        for sample_id in sample_ids:
+            self.execute(text("DROP TABLE IF EXISTS %s"
+                              % cell_partition_name(sample_id)))
+
     def insert_cells_mappings(self, sample_id, cells, chunksize=10000,
+                              loader='orm', pipelined=False, queue_depth=2,
                               **kwargs):
         """ Insert cell quantification data into cells table.
 
@@ -111,53 +227,220 @@ class CycSession(Session):
             If str, it's path string to a csv file.
         chunksize: int or None.
             Used in `pd.read_csv`.
+        loader: str, default is 'orm'.
+            One of ['orm', 'copy']. 'orm' inserts each chunk by an
+            executemany of a single-row INSERT; 'copy' streams each chunk
+            into the `cell` table with PostgreSQL `COPY ... FROM STDIN`.
+        pipelined: bool, default is False.
+            If True, chunks are read and transformed in background threads
+            while the previous chunks are being written to database.
+        queue_depth: int, default is 2.
+            The maximum number of chunks waiting between pipeline stages,
+            which bounds the memory usage. Only relevant when `pipelined`
+            is True.
         kwargs: keywords parameter.
             Addtional parameters used `pd.read_csv`.
+
+        Notes
+        -----
+        Cells are written into the partition of the sample, which is
+        created if missing and attached to `cell` at the end. Summary
+        statistics of the markers are computed from the chunks and saved
+        into `sample_feature_stats`.
         """
         if not isinstance(cells, (str, DataFrame)):
             raise ValueError("Unsupported datatype for cells!")
+        if loader not in CELL_LOADERS:
+            raise ValueError("Argument `loader` must be one of {}, but got "
+                             "`{}`!".format(list(CELL_LOADERS), loader))
+        self.create_cell_partition(sample_id)
+        partition = cell_partition(sample_id)
 
         markers, others = get_headers_categorized(cells)
         marker_db_keys = [self.marker_header_to_dbkey(x) for x in markers]
         other_columns = [self.other_feature_to_dbcolumn(x) for x in others]
+        self.update_feature_manifest(sample_id, marker_db_keys)
+
+        if loader == 'copy':
+            prepare, write = self._prepare_copy_cells, self._write_copy_cells
+        else:
+            prepare, write = (self._prepare_cells_mappings,
+                              self._write_cells_mappings)
+
+        feature_stats = {key: Feature_Stats() for key in marker_db_keys}
+
+        def transform(df):
+            prepared = prepare(df, markers, marker_db_keys, others,
+                               other_columns, sample_id)
+            return prepared, self._compute_feature_stats(
+                df, markers, marker_db_keys)
+
+        def consume(item):
+            prepared, chunk_stats = item
+            for key, stats in chunk_stats.items():
+                feature_stats[key].merge(stats)
+            return write(prepared, table=partition)
 
         if isinstance(cells, DataFrame):
-            count = cells.shape[0]
-            for i in range(0, count, chunksize):
-                df = cells[i: i+chunksize]
-                self._batch_insert_cells_mappings(df, markers, marker_db_keys,
-                                                  others, other_columns,
-                                                  sample_id)
+            chunks = (cells[i: i+chunksize]
+                      for i in range(0, cells.shape[0], chunksize))
+        else:
+            chunks = pd.read_csv(cells, chunksize=chunksize, iterator=True,
+                                 **kwargs)
+
+        if pipelined:
+            count = sum(run_pipeline(chunks, transform, consume,
+                                     queue_depth=queue_depth))
         else:
-            count = 0
-            for df in pd.read_csv(cells, chunksize=chunksize, iterator=True,
-                                  **kwargs):
-                self._batch_insert_cells_mappings(df, markers, marker_db_keys,
-                                                  others, other_columns,
-                                                  sample_id)
-                count += df.shape[0]
+            count = sum(consume(transform(df)) for df in chunks)
+        self.update_feature_stats(sample_id, feature_stats)
+        self.attach_cell_partition(sample_id)
+        if self.cells_cache is not None:
+            self.cells_cache.invalidate([sample_id])
+        if self.matrix_cache is not None:
+            self.matrix_cache.invalidate([sample_id])
         log.info("Added total %d cell records!" % count)
 
-    def _batch_insert_cells_mappings(self, dataframe, markers, marker_db_keys,
-                                     others, other_columns, sample_id):
-        """ helper function for insert cells mappings
+    def _compute_feature_stats(self, dataframe, markers, marker_db_keys):
+        """ helper function for insert cells mappings. Compute the stats
+        of markers in a chunk, on the values rounded as in database.
         """
-        df = dataframe.round(decimals=self.decimals)
-
-        df_markers = df.loc[:, markers]
-        df_markers.columns = marker_db_keys
-        marker_obs = df_markers.to_dict('records')
+        values = dataframe.loc[:, markers].round(decimals=self.decimals)
+        rval = {}
+        for i, key in enumerate(marker_db_keys):
+            rval[key] = Feature_Stats()
+            rval[key].update(values.iloc[:, i].to_numpy(dtype='float64'))
+        return rval
 
-        df_others = df.loc[:, others]
+    def _prepare_cells_mappings(self, dataframe, markers, marker_db_keys,
+                                others, other_columns, sample_id):
+        """ helper function for insert cells mappings. Convert a chunk of
+        cells to parameters of INSERT.
+        """
+        df_others = dataframe.loc[:, others].round(decimals=self.decimals)
         df_others.columns = other_columns
         df_others['sample_id'] = sample_id
-        cell_obs = df_others.to_dict('records')
-        for idx, ob in enumerate(cell_obs):
-            ob['features'] = marker_obs[idx]
+        df_others['features_json'] = encode_features(
+            dataframe.loc[:, markers], keys=marker_db_keys,
+            decimals=self.decimals)
+        return df_others.to_dict('records')
+
+    def _write_cells_mappings(self, cell_obs, table=None):
+        """ helper function for insert cells mappings. Returns the number
+        of cells added.
+        """
+        if table is None:
+            table = Cell.__table__
+        self.execute(
+            table.insert().values(features=cast(
+                bindparam('features_json', type_=String), JSONB)),
+            cell_obs)
+        log.info("Added %d cell records." % len(cell_obs))
+        return len(cell_obs)
+
+    def _prepare_copy_cells(self, dataframe, markers, marker_db_keys,
+                            others, other_columns, sample_id):
+        """ helper function for insert cells mappings, using
+        `COPY ... FROM STDIN`. Convert a chunk of cells to CSV.
+        """
+        df_copy = dataframe.loc[:, others].round(decimals=self.decimals)
+        df_copy.columns = other_columns
+        df_copy['sample_id'] = sample_id
+        df_copy['features'] = encode_features(
+            dataframe.loc[:, markers], keys=marker_db_keys,
+            decimals=self.decimals)
+
+        columns = other_columns + ['sample_id', 'features']
+        buffer = to_copy_buffer(df_copy, columns=columns)
+        return buffer, columns, df_copy.shape[0]
+
+    def _write_copy_cells(self, prepared, table=None):
+        """ helper function for insert cells mappings, using
+        `COPY ... FROM STDIN`. The COPY runs on the connection of
+        current transaction, so commit/rollback works the same as
+        `_write_cells_mappings`. Returns the number of cells added.
+        """
+        if table is None:
+            table = Cell.__table__
+        buffer, columns, count = prepared
+        sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+            table.name, ', '.join(columns))
 
-        self.bulk_insert_mappings(Cell, cell_obs)
+        cursor = self.connection().connection.cursor()
+        try:
+            cursor.copy_expert(sql, buffer)
+        finally:
+            cursor.close()
+        log.info("Copied %d cell records." % count)
+        return count
+
+    def update_feature_manifest(self, sample_id, db_keys, replace=False):
+        """ Record the marker feature keys of a sample in
+        `sample_feature` table. Keys not in the manifest yet are appended
+        in order.
+
+        Parameters
+        ----------
+        sample_id: int.
+            Index of sample object in database.
+        db_keys: list of str.
+            The JSON keys in `Cell.features`, like `56_cl`.
+        replace: bool, default is False.
+            Whether to replace the existing manifest of the sample.
+        """
+        query = self.query(Sample_Feature.db_key) \
+            .filter(Sample_Feature.sample_id == sample_id)
+        if replace:
+            query.delete(synchronize_session=False)
+            existing = []
+        else:
+            existing = [x for x, in query]
+
+        mappings = []
+        for key in db_keys:
+            if key in existing:
+                continue
+            marker_id, mask_type = parse_db_key(key)
+            mappings.append(dict(
+                sample_id=sample_id, position=len(existing), db_key=key,
+                marker_id=marker_id, mask_type=mask_type))
+            existing.append(key)
+
+        self.bulk_insert_mappings(Sample_Feature, mappings)
         self.flush()
-        log.info("Added %d cell records." % len(cell_obs))
+        log.info("Added %d entries of sample feature manifest!"
+                 % len(mappings))
+
+    def update_feature_stats(self, sample_id, feature_stats):
+        """ Merge stats into `sample_feature_stats` of a sample.
+
+        Parameters
+        ----------
+        sample_id: int.
+            Index of sample object in database.
+        feature_stats: dict.
+            In `db_key: Feature_Stats` format.
+        """
+        existing = {x.db_key: x for x in self.query(Sample_Feature_Stats)
+                    .filter(Sample_Feature_Stats.sample_id == sample_id)}
+        for key, stats in feature_stats.items():
+            row = existing.get(key)
+            if row is None:
+                row = Sample_Feature_Stats(sample_id=sample_id, db_key=key)
+                self.add(row)
+            else:
+                merged = _row_to_feature_stats(row)
+                merged.merge(stats)
+                stats = merged
+            row.count = stats.count
+            row.min = stats.min
+            row.max = stats.max
+            row.mean = stats.mean if stats.count else None
+            row.m2 = stats.m2 if stats.count else None
+            row.sketch = stats.sketch.to_dict()
+        self.flush()
+        log.info("Updated stats of %d features for sample %d!"
+                 % (len(feature_stats), sample_id))
 
     def add_marker(self, marker):
         """ Add marker object
@@ -183,34 +466,97 @@ class CycSession(Session):
 
     def insert_or_sync_markers(self):
         """ Sync stock markers in `markers.tsv` with database.
+
+        The stock markers and aliases are staged into temporary tables,
+        then upserted against the unique indices `ix_marker_name` and
+        `ix_marker_alias` in a few set-based statements. An alias already
+        in database is re-pointed if it belongs to another marker in
+        `markers.tsv`.
+
+        Returns
+        -------
+        Dict, the summary of changes, having keys `markers_inserted`,
+        `aliases_inserted` and `aliases_repointed`.
         """
         if not hasattr(self, 'data_frame'):
             self.load_dataframe_util()
 
         markers_df = self.data_frame.stock_markers.markers_df
+        # aliases are unique ignoring cases. The last marker wins when an
+        # alias is listed for multiple markers.
+        stock_aliases = {}
+        for idx, aliases in enumerate(markers_df['aliases'], start=1):
+            for alias in aliases.split(','):
+                alias = alias.strip()
+                if alias:
+                    name = stock_aliases.get(alias.lower(), (alias, None))[0]
+                    stock_aliases[alias.lower()] = (name, idx)
+        alias_names = [x[0] for x in stock_aliases.values()]
+        alias_marker_idx = [x[1] for x in stock_aliases.values()]
+
         try:
-            for marker in markers_df.to_dict('records'):
-                aliases = marker.pop('aliases')
-                marker_id = self.get_or_create_marker(marker).id
-                for alias in aliases.split(','):
-                    obj = self.query(Marker_Alias).filter(
-                        func.lower(Marker_Alias.name) == format_marker(alias))\
-                        .first()
-                    if not obj:
-                        alias = Marker_Alias(name=alias.strip(),
-                                             marker_id=marker_id)
-                        self.add(alias)
-                        log.info("Added marker alias %s" % repr(alias))
-                    elif obj.marker_id != marker_id:
-                        obj.marker_id = marker_id
-                        log.info("Updated marker_id to %s for %s."
-                                 % (marker_id, repr(obj)))
-                    self.flush()
+            self.execute(text(
+                "CREATE TEMPORARY TABLE stock_marker ON COMMIT DROP AS "
+                "SELECT * FROM unnest(CAST(:name AS text[]), "
+                "CAST(:fluor AS text[]), CAST(:anti AS text[]), "
+                "CAST(:duplicate AS text[])) WITH ORDINALITY "
+                "AS t(name, fluor, anti, duplicate, idx)"),
+                {k: list(markers_df[k]) for k in
+                 ('name', 'fluor', 'anti', 'duplicate')})
+
+            markers_inserted = self.execute(text(
+                "INSERT INTO marker (name, fluor, anti, duplicate) "
+                "SELECT name, fluor, anti, duplicate FROM stock_marker "
+                "ORDER BY idx "
+                "ON CONFLICT (lower(name), lower(fluor), lower(anti), "
+                "lower(duplicate)) DO NOTHING "
+                "RETURNING id, name, fluor, anti, duplicate")).fetchall()
+
+            self.execute(text(
+                "CREATE TEMPORARY TABLE stock_marker_alias ON COMMIT DROP AS "
+                "SELECT a.name, m.id AS marker_id "
+                "FROM unnest(CAST(:name AS text[]), CAST(:idx AS int[])) "
+                "AS a(name, idx) "
+                "JOIN stock_marker s ON s.idx = a.idx "
+                "JOIN marker m ON lower(m.name) = lower(s.name) "
+                "AND lower(m.fluor) = lower(s.fluor) "
+                "AND lower(m.anti) = lower(s.anti) "
+                "AND lower(m.duplicate) = lower(s.duplicate)"),
+                {'name': alias_names, 'idx': alias_marker_idx})
+
+            aliases_inserted = self.execute(text(
+                "INSERT INTO marker_alias (name, marker_id) "
+                "SELECT name, marker_id FROM stock_marker_alias "
+                "ON CONFLICT (lower(name)) DO NOTHING "
+                "RETURNING name, marker_id")).fetchall()
+
+            aliases_repointed = self.execute(text(
+                "UPDATE marker_alias AS a SET marker_id = s.marker_id "
+                "FROM stock_marker_alias s, marker_alias o "
+                "WHERE o.id = a.id AND lower(a.name) = lower(s.name) "
+                "AND a.marker_id IS DISTINCT FROM s.marker_id "
+                "RETURNING a.name, o.marker_id, a.marker_id")).fetchall()
+
             self.commit()
         except Exception:
             self.rollback()
             raise
-        log.info("Insert or Sync stock markers completed!")
+        finally:
+            self.clear_alias_map()
+            self.clear_marker_map()
+
+        rval = {
+            'markers_inserted': [tuple(x) for x in markers_inserted],
+            'aliases_inserted': [tuple(x) for x in aliases_inserted],
+            'aliases_repointed': [tuple(x) for x in aliases_repointed],
+        }
+        for name, old_id, new_id in rval['aliases_repointed']:
+            log.info("Updated marker_id from %s to %s for marker alias `%s`."
+                     % (old_id, new_id, name))
+        log.info("Insert or Sync stock markers completed! Inserted %d "
+                 "markers and %d aliases, re-pointed %d aliases."
+                 % tuple(len(v) for v in rval.values()))
+        return rval
 
     def insert_sample_markers(self, sample_id, markers, **kwargs):
         """ Insert sample marker association into database.
@@ -256,7 +602,8 @@ class CycSession(Session):
                  % len(associates))
 
     def add_sample_complex(self, sample, cells, markers, chunksize=10000,
-                           dry_run=False, **kwargs):
+                           dry_run=False, loader='orm', pipelined=False,
+                           queue_depth=2, **kwargs):
         """ Insert the quantification result from a single sample
         into database, including cell quantification table and
         marker list table.
@@ -273,6 +620,12 @@ class CycSession(Session):
             Used in `pd.read_csv`. Read in chunks.
         dry_run: bool, default is False.
             Whether to run the sample adding without commit.
+        loader: str, default is 'orm'.
+            One of ['orm', 'copy']. Used in `insert_cells_mappings`.
+        pipelined: bool, default is False.
+            Used in `insert_cells_mappings`.
+        queue_depth: int, default is 2.
+            Used in `insert_cells_mappings`.
         kwargs: keywords parameter.
             Addtional parameters used `pd.read_csv`.
         """
@@ -287,7 +640,8 @@ class CycSession(Session):
         try:
             sample = self.add_sample(sample)
             self.insert_cells_mappings(sample.id, cells, chunksize=chunksize,
-                                       **kwargs)
+                                       loader=loader, pipelined=pipelined,
+                                       queue_depth=queue_depth, **kwargs)
             self.insert_sample_markers(sample.id, markers, **kwargs)
             if not dry_run:
                 self.commit()
@@ -312,19 +666,30 @@ class CycSession(Session):
             The name of the sample.
         tag: str, default is None.
             The tag of the sample.
+
+        Notes
+        -----
+        Cells of the sample are removed by dropping its partition.
         """
         if id is not None:
-            self.query(Sample).filter_by(id=id).delete()
+            query = self.query(Sample).filter_by(id=id)
         else:
             assert name and isinstance(name, str), \
                 "Argument `name` must be a valid string!"
-            self.query(Sample)\
+            query = self.query(Sample)\
                 .filter(func.lower(Sample.name) == name.lower())\
                 .filter((Sample.tag == tag)
-                        | (func.lower(Sample.tag) == str(tag).lower()))\
-                .delete(synchronize_session='fetch')
+                        | (func.lower(Sample.tag) == str(tag).lower()))
+
+        sample_ids = [x for x, in query.with_entities(Sample.id)]
+        self.drop_cell_partitions(sample_ids)
+        query.delete(synchronize_session='fetch')
 
         self.commit()
+        if self.cells_cache is not None:
+            self.cells_cache.invalidate(sample_ids)
+        if self.matrix_cache is not None:
+            self.matrix_cache.invalidate(sample_ids)
 
     def delete_marker(self, id=None, name=None):
         """ Remove a marker and its related records from database
@@ -346,22 +711,33 @@ class CycSession(Session):
             self.query(Marker).filter_by(name=name).delete()
 
         self.commit()
+        self.clear_alias_map()
+        self.clear_marker_map()
 
     def delete_all(self):
         """ Remove all records in all tables in the database.
         """
+        self.drop_cell_partitions(
+            [x for x, in self.query(Sample.id)])
         self.query(Sample).delete()
         self.query(Marker).delete()
         self.query(Cell).delete()
         self.query(Sample_Marker_Association).delete()
 
         self.commit()
+        self.clear_alias_map()
+        self.clear_marker_map()
+        if self.cells_cache is not None:
+            self.cells_cache.clear()
+        if self.matrix_cache is not None:
+            self.matrix_cache.clear()
 
     ###################################################
     #              Data update
     ###################################################
     def update_sample_feature_list(self, sample, cells, **kwargs):
-        """ Standalone util to update feature list for a sample.
+        """ Standalone util to rebuild the feature manifest for a sample
+        from the headers of its cells table.
 
         Parameters
         ----------
@@ -372,43 +748,30 @@ class CycSession(Session):
             Addtional parameters used `pd.read_csv`.
         """
         if isinstance(cells, str):
-            cells = pd.read_csv(cells, **kwargs)
+            cells = pd.read_csv(cells, nrows=0, **kwargs)
         elif not isinstance(cells, DataFrame):
             raise ValueError("Unsupported datatype for cells!")
 
-        if isinstance(sample, Sample):
-            name = sample.name
-            tag = sample.tag
-        elif isinstance(sample, dict):
-            name = sample['name']
-            tag = sample.get('tag', None)
-        else:
-            raise ValueError("Unsupported data type for `sample`!")
-
-        if not hasattr(self, 'data_frame'):
-            self.load_dataframe_util()
-        cells.columns = cells.columns.map(self.data_frame.header_to_dbcolumn)
-        feature_list = ','.join(list(cells.columns))
-
-        query = self.query(Sample)\
-            .filter(func.lower(Sample.name) == name.lower())\
-            .filter((Sample.tag == tag)
-                    | (func.lower(Sample.tag) == str(tag).lower()))\
-
-        if not query.first():
+        sample_id = self.get_sample_id(sample)
+        if sample_id is None:
             raise Exception("Update database failed. No matching sample "
                             "was found!")
 
+        markers, _ = get_headers_categorized(cells)
+        db_keys = [self.marker_header_to_dbkey(x) for x in markers]
         try:
-            query.update(dict(feature_list=feature_list),
-                         synchronize_session=False)
+            self.update_feature_manifest(sample_id, db_keys, replace=True)
             self.commit()
         except Exception:
             self.rollback()
             raise
+        if self.cells_cache is not None:
+            self.cells_cache.invalidate([sample_id])
+        if self.matrix_cache is not None:
+            self.matrix_cache.invalidate([sample_id])
 
         log.info("Update feature list for sample `%s`: %s"
-                 % (sample, feature_list))
+                 % (sample, ','.join(db_keys)))
 
     ###################################################
     #              Data Query
@@ -424,11 +787,130 @@ class CycSession(Session):
         --------
         Int or None.
         """
-        marker_id = self.query(Marker_Alias.marker_id) \
-            .filter(func.lower(Marker_Alias.name) == format_marker(alias)) \
-            .scalar()
+        return self.get_alias_map().get(format_marker(alias))
+
+    def resolve_marker(self, marker):
+        """ Resolve a marker name or alias to a marker, ignoring cases,
+        whitespaces, hyphens and underscores, e.g., `CD45`, `cd 45` and
+        `cd-45` are all resolved to the marker `CD45`.
+
+        Parameters
+        ----------
+        marker: str.
+
+        Returns
+        --------
+        Marker_Record object.
+        """
+        alias_map = self.get_alias_map()
+        marker_id = alias_map.get(marker.lower())
+        if marker_id is None:
+            marker_id = alias_map.get(format_marker(marker))
+        if marker_id is None:
+            squashed = format_marker(marker).replace('_', '')
+            candidates = {v for k, v in alias_map.items()
+                          if k.replace('_', '') == squashed}
+            if len(candidates) > 1:
+                raise ValueError(f"Marker `{marker}` is ambiguous, which "
+                                 f"matches marker ids {sorted(candidates)}!")
+            if candidates:
+                marker_id = candidates.pop()
+        if marker_id is None:
+            raise ValueError(f"No marker alias matches `{marker}`!")
+
+        return self.get_marker_record(marker_id)
+
+    def get_alias_map(self, reload=False):
+        """ Load the whole `marker_alias` table into a dict, which is
+        cached in the session and used to resolve marker names in memory.
+
+        Parameters
+        ----------
+        reload: bool, default is False.
+            Whether to discard the cache and query database again.
+
+        Returns
+        --------
+        Dict, in `format_marker(alias): marker_id` format.
+        """
+        if self._alias_map is None or reload:
+            aliases = self.query(Marker_Alias.name,
+                                 Marker_Alias.marker_id).all()
+            alias_map = {}
+            for name, marker_id in aliases:
+                alias_map.setdefault(format_marker(name), marker_id)
+            # exact matches take precedence over the formatted ones
+            for name, marker_id in aliases:
+                alias_map[name.lower()] = marker_id
+            self._alias_map = alias_map
+            log.info("Loaded %d marker aliases." % len(aliases))
+
+        return self._alias_map
+
+    def clear_alias_map(self):
+        """ Invalidate the cached marker aliases.
+        """
+        self._alias_map = None
+
+    def get_marker_map(self, reload=False):
+        """ Load the whole `marker` table into a dict, which is cached in
+        the session and used by `DB_Key` to look up markers in memory.
+
+        Parameters
+        ----------
+        reload: bool, default is False.
+            Whether to discard the cache and query database again.
+
+        Returns
+        --------
+        Dict, in `marker_id: Marker_Record` format.
+        """
+        if self._marker_map is None or reload:
+            markers = self.query(Marker.id, Marker.name, Marker.fluor,
+                                 Marker.anti, Marker.duplicate).all()
+            self._marker_map = {x[0]: Marker_Record(*x) for x in markers}
+            self._comparators = {}
+            log.info("Loaded %d markers." % len(markers))
+
+        return self._marker_map
+
+    def get_marker_record(self, marker_id):
+        """ get a Marker_Record by id from the cached markers. The cache
+        is reloaded once if the id is missing, e.g. the marker was added
+        afterwards.
+
+        Returns
+        -------
+        Marker_Record object or None.
+        """
+        rval = self.get_marker_map().get(marker_id)
+        if rval is None:
+            rval = self.get_marker_map(reload=True).get(marker_id)
+        return rval
+
+    def get_marker_comparator(self, marker_id, fluor_sensitive=True,
+                              anti_sensitive=False, keep_duplicates='keep'):
+        """ get a cached Marker_Comparator of a marker, one per marker
+        and comparison flags.
+        """
+        key = (marker_id, fluor_sensitive, anti_sensitive, keep_duplicates)
+        rval = self._comparators.get(key)
+        if rval is None:
+            marker = self.get_marker_record(marker_id)
+            if marker is None:
+                raise ValueError(f"No marker has id `{marker_id}`!")
+            rval = Marker_Comparator(
+                marker, fluor_sensitive=fluor_sensitive,
+                anti_sensitive=anti_sensitive,
+                keep_duplicates=keep_duplicates)
+            self._comparators[key] = rval
+        return rval
 
-        return marker_id
+    def clear_marker_map(self):
+        """ Invalidate the cached markers and comparators.
+        """
+        self._marker_map = None
+        self._comparators = {}
 
     def get_or_create_marker(self, marker):
         """ Fetch a Marker object from markers table.
@@ -627,8 +1109,208 @@ class CycSession(Session):
 
         return rval
 
+    def select_db_keys(self, db_keys, markers=None, mask_types=None):
+        """ Select marker keys by markers and mask types.
+
+        Parameters
+        ----------
+        db_keys: list of str.
+            Keys of `Cell.features`, like ['56_cl', '56_nu'].
+        markers: list of str or None.
+            Marker names or aliases, resolved by `resolve_marker`. A key
+            is selected if its marker has the same name, and the same
+            fluor, anti and duplicate when the requested marker has them.
+            e.g., `CD45` selects `CD45` and `CD45_1`, but `CD45_1`
+            selects `CD45_1` only. Default is all markers.
+        mask_types: list of str or None.
+            Subset of ['cell_masks', 'nuclei_masks']. Default is all.
+
+        Returns
+        -------
+        List of str, in the order of `db_keys`.
+        """
+        if mask_types is not None:
+            mask_types = [MASK_TYPES.get(x, x) for x in mask_types]
+            invalid = set(mask_types) - set(MASK_TYPES.values())
+            if invalid:
+                raise ValueError("Argument `mask_types` must be subset of {}"
+                                 ", but got `{}`!".format(
+                                     list(MASK_TYPES.values()),
+                                     sorted(invalid)))
+        if markers is not None:
+            if isinstance(markers, str):
+                markers = [markers]
+            markers = [self.resolve_marker(x) for x in markers]
+
+        rval = []
+        for key in db_keys:
+            marker_id, mask_type = parse_db_key(key)
+            if mask_types is not None and mask_type not in mask_types:
+                continue
+            if markers is not None and not any(
+                    _marker_matches(self.get_marker_record(marker_id), x)
+                    for x in markers):
+                continue
+            rval.append(key)
+        return rval
+
+    def compile_filters(self, filters):
+        """ Compile gating filters into a SQL expression on `Cell`.
+
+        A feature in filters is either a non-marker feature, like `area`
+        or `X_centroid`, or a marker with mask type, like
+        `CD3__cell_masks` or `cd-3__nu`, whose marker is resolved by
+        `resolve_marker`. Cells having NULL for a feature in a comparison
+        are filtered out, even under `~`.
+
+        Parameters
+        ----------
+        filters: str or list of str.
+            Expressions like 'CD3__cell_masks > 500 & area < 200', see
+            `cycif_db.query.parse_filter` for the syntax.
+
+        Returns
+        -------
+        sqlalchemy clause.
+        """
+        if isinstance(filters, str):
+            filters = [filters]
+        clauses = [self._compile_filter_node(parse_filter(x))
+                   for x in filters]
+        return and_(*clauses)
+
+    def _compile_filter_node(self, node):
+        """ helper function for `compile_filters`.
+        """
+        if node[0] == 'and':
+            return and_(self._compile_filter_node(node[1]),
+                        self._compile_filter_node(node[2]))
+        if node[0] == 'or':
+            return or_(self._compile_filter_node(node[1]),
+                       self._compile_filter_node(node[2]))
+        if node[0] == 'not':
+            return not_(self._compile_filter_node(node[1]))
+
+        _, op, name, value = node
+        column = self._get_filter_column(name)
+        return {
+            '<': column < value,
+            '<=': column <= value,
+            '>': column > value,
+            '>=': column >= value,
+            '==': column == value,
+            '!=': column != value,
+        }[op]
+
+    def _get_filter_column(self, name):
+        """ helper function for `compile_filters`. Map a feature name
+        to the column expression.
+        """
+        if name in OTHER_FEATHERS:
+            return getattr(Cell, name)
+        marker, sep, mask_type = name.rpartition('__')
+        if not sep:
+            return getattr(Cell, self.other_feature_to_dbcolumn(name))
+
+        suffixes = {v: k for k, v in MASK_TYPES.items()}
+        mask_type = mask_type.lower()
+        if mask_type in MASK_TYPES:
+            suffix = mask_type
+        elif mask_type in suffixes:
+            suffix = suffixes[mask_type]
+        else:
+            raise ValueError(f"Unrecognized mask type in filter feature "
+                             f"`{name}`!")
+        key = '%d_%s' % (self.resolve_marker(marker).id, suffix)
+        return cast(Cell.features[key].astext, Float)
+
+    def _sample_cells(self, query, sample_fraction=None,
+                      max_cells_per_sample=None, seed=None):
+        """ helper function for cells export. Randomly subsample the
+        cells of a query in database.
+
+        Cells are ranked by a seeded hash of `sample_id` and
+        `sample_cell_id`, instead of `TABLESAMPLE` or `random()`, so a
+        seed selects the same cells regardless of the physical order of
+        rows, and the fraction and the cap are consistent with each other.
+        Samples sharing cell ids still get independent subsets.
+        """
+        if sample_fraction is None and max_cells_per_sample is None:
+            return query
+        if sample_fraction is not None and not 0 < sample_fraction <= 1:
+            raise ValueError("Argument `sample_fraction` must be in (0, 1],"
+                             " but got `{}`!".format(sample_fraction))
+        if max_cells_per_sample is not None and (
+                not isinstance(max_cells_per_sample, int)
+                or max_cells_per_sample < 0):
+            raise ValueError("Argument `max_cells_per_sample` must be a "
+                             "non-negative integer, but got `{}`!"
+                             .format(max_cells_per_sample))
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+            log.info("Sampling cells with seed %d." % seed)
+
+        # (sample_id << 32) | sample_cell_id, the cell id in 32 bits
+        cell_key = cast(Cell.sample_id, BigInteger).op('<<')(32).op('|')(
+            cast(func.coalesce(Cell.sample_cell_id, Cell.id), BigInteger)
+            .op('&')(0xFFFFFFFF))
+        rank = func.hashint8extended(cell_key, seed)
+        if sample_fraction is not None and sample_fraction < 1:
+            query = query.filter(
+                rank < HASH_MIN + int(sample_fraction * HASH_RANGE))
+        if max_cells_per_sample is None:
+            return query
+
+        ranked = query.with_entities(
+            Cell.id.label('id'), Cell.sample_id.label('sample_id'),
+            func.row_number().over(
+                partition_by=Cell.sample_id,
+                order_by=(rank, Cell.id)).label('rank')) \
+            .order_by(None).subquery()
+        return query.join(ranked, and_(ranked.c.id == Cell.id,
+                                       ranked.c.sample_id == Cell.sample_id)) \
+            .filter(ranked.c.rank <= max_cells_per_sample)
+
+    def _get_cell_columns(self, db_keys, features=None, markers=None,
+                          mask_types=None):
+        """ helper function for cells export. Project the requested
+        features and marker keys.
+
+        Returns
+        -------
+        Tuple of (list of columns to query, list of DataFrame headers).
+        """
+        other_features = sorted(list(OTHER_FEATHERS.keys()),
+                                key=column_sort_key)
+        if features is not None:
+            if isinstance(features, str):
+                features = [features]
+            features = {x if x in OTHER_FEATHERS
+                        else self.other_feature_to_dbcolumn(x)
+                        for x in features}
+            # the cell identifier is always exported
+            features.add('sample_cell_id')
+            other_features = [x for x in other_features if x in features]
+        cell_columns = [getattr(Cell, ftr) for ftr in other_features]
+
+        db_keys = self.select_db_keys(db_keys, markers=markers,
+                                      mask_types=mask_types)
+        cell_columns += [Cell.features[key] for key in db_keys]
+
+        marker_headers = [DB_Key(self, k, anti_sensitive=True).to_header()
+                          for k in db_keys]
+        columns = other_features + marker_headers
+
+        return cell_columns, columns
+
     def get_cells_for_sample(self, sample=None, name=None, tag=None,
-                             to_path=None, **kwargs):
+                             to_path=None, chunksize=None, exporter='pandas',
+                             to_parquet=None, marker_dtype='float64',
+                             markers=None, features=None, mask_types=None,
+                             filters=None, sample_fraction=None,
+                             max_cells_per_sample=None, seed=None,
+                             bbox=None, center=None, radius=None,
+                             **kwargs):
         """ Retrieve all cells for a sample and convert to pandas DataFrame.
 
         Parameters
@@ -643,12 +1325,67 @@ class CycSession(Session):
             Tag of the sample, ignoring cases.
         to_path: str, default is None.
             If provided, this is the path to save the cells data.
+        chunksize: int or None.
+            If provided, cells are streamed from a server-side cursor in
+            chunks of this many rows, so the memory usage is bounded.
+        exporter: str, default is 'pandas'.
+            One of ['pandas', 'copy']. 'copy' streams the query result
+            into `to_path` with PostgreSQL `COPY ... TO STDOUT`, without
+            loading any row in Python. It requires `to_path` and doesn't
+            write the index column.
+        to_parquet: str, default is None.
+            If provided, this is the directory to save the cells data as
+            a Parquet dataset partitioned by `sample_name` and
+            `sample_tag`, streamed in chunks of `chunksize` rows. Marker
+            columns are float32.
+        marker_dtype: str, default is 'float64'.
+            The dtype of marker columns in DataFrame, 'float64' or
+            'float32'. Other features are float64 and `sample_cell_id`
+            is int64.
+        markers: list of str or None.
+            Marker names or aliases to export, e.g., ['CD45', 'cd-3'].
+            See `select_db_keys`. Default is all markers.
+        features: list of str or None.
+            Non-marker features to export, e.g., ['x_centroid', 'Area'].
+            `sample_cell_id` is always exported. Default is all.
+        mask_types: list of str or None.
+            Subset of ['cell_masks', 'nuclei_masks'] to export. Default
+            is all.
+        filters: str, list of str or None.
+            Gating filters run in database, e.g.,
+            'CD3__cell_masks > 500 & area < 200'. See `compile_filters`.
+            Multiple filters are combined by `and`.
+        sample_fraction: float or None.
+            If provided, a random subset of about this fraction of cells,
+            0 < sample_fraction <= 1, is exported from each sample.
+        max_cells_per_sample: int or None.
+            If provided, at most this many random cells are exported
+            from each sample.
+        seed: int or None.
+            Seed of the random sampling. The same seed selects the same
+            cells. Default is a random seed.
+        bbox: tuple of 4 numbers or None.
+            If provided, only cells whose centroid is in the bounding box
+            `(x_min, y_min, x_max, y_max)` are exported.
+        center: tuple of 2 numbers or None.
+            Used with `radius`. If provided, only cells whose centroid is
+            within `radius` from `center`, `(x, y)`, are exported.
+        radius: number or None.
         kwargs: Key words arguments
             Used in pandas dataframe `to_csv`.
 
         Returns
         -------
-        pandas DataFrame object.
+        pandas DataFrame object. If `chunksize` is provided, an iterator
+        of DataFrame objects instead, or None with `to_path`, in which
+        case the chunks are written to the file one by one. None if
+        `exporter` is 'copy' or `to_parquet` is provided.
+
+        With the session's `matrix_cache`, a pandas DataFrame of all cells,
+        with `marker_dtype='float32'` and without `filters`, sampling or
+        region, is memory-mapped from the cache, written on first access.
+        All its features are float32 and read-only, `copy` it before
+        changing values.
         """
         if not isinstance(sample, (int, Sample, type(None))):
             raise ValueError("The argument `sample` was provided, but it "
@@ -658,29 +1395,119 @@ class CycSession(Session):
 
         assert sample, ("No matching record found for the sample!")
 
-        other_features = sorted(list(OTHER_FEATHERS.keys()),
-                                key=column_sort_key)
-        cell_columns = [getattr(Cell, ftr) for ftr in other_features]
         feature_list = self.get_sample_db_keys(sample)
-        cell_columns += [Cell.features[key] for key in feature_list]
+        cell_columns, columns = self._get_cell_columns(
+            feature_list, features=features, markers=markers,
+            mask_types=mask_types)
+
+        if self.matrix_cache is not None and exporter == 'pandas' \
+                and marker_dtype == 'float32' and not chunksize \
+                and not to_parquet and not filters \
+                and sample_fraction is None and max_cells_per_sample is None \
+                and bbox is None and center is None and radius is None:
+            df = self._load_cells_matrix(sample, feature_list)
+            if list(df.columns) != columns:
+                df = df[columns]
+            df.insert(0, 'sample_name', sample.name)
+            df.insert(1, 'sample_tag', sample.tag)
+            if to_path:
+                df.to_csv(to_path, **kwargs)
+            return df
+
+        query = self.query(Sample.name, Sample.tag, *cell_columns)\
+            .join(Sample, Cell.sample) \
+            .filter(Cell.sample_id == sample.id) \
+            .order_by(Cell.sample_cell_id)
+        if filters:
+            query = query.filter(self.compile_filters(filters))
+        if bbox is not None or center is not None or radius is not None:
+            query = query.filter(_region_clause(bbox, center, radius))
+        query = self._sample_cells(
+            query, sample_fraction=sample_fraction,
+            max_cells_per_sample=max_cells_per_sample, seed=seed)
+
+        columns = ['sample_name', 'sample_tag'] + columns
+
+        return self._export_cells(query, columns, to_path=to_path,
+                                  chunksize=chunksize, exporter=exporter,
+                                  to_parquet=to_parquet,
+                                  marker_dtype=marker_dtype, **kwargs)
+
+    def _load_cells_matrix(self, sample, feature_list):
+        """ Memory-map all the numeric features of a sample from
+        `matrix_cache`, querying and caching them on a miss. The queried
+        cells, in float32, are returned if they can't be cached or
+        mapped.
+        """
+        rval = self.matrix_cache.load(sample.id, sample.entry_at,
+                                      feature_list)
+        if rval is not None:
+            return rval
 
-        data = self.query(Sample.name, Sample.tag, *cell_columns)\
-            .join(Sample) \
+        cell_columns, columns = self._get_cell_columns(feature_list)
+        query = self.query(*cell_columns) \
             .filter(Cell.sample_id == sample.id) \
-            .order_by(Cell.sample_cell_id) \
-            .all()
+            .order_by(Cell.sample_cell_id)
+        df = self._export_cells(query, columns, marker_dtype='float32')
+        if self.matrix_cache.save(sample.id, sample.entry_at, feature_list,
+                                  df):
+            rval = self.matrix_cache.load(sample.id, sample.entry_at,
+                                          feature_list)
+            if rval is not None:
+                return rval
+        return df.astype({x: 'float32' for x in columns
+                          if x != 'sample_cell_id'})
 
-        marker_headers = [DB_Key(self, k, anti_sensitive=True).to_header()
-                          for k in feature_list]
-        df = pd.DataFrame(
-            data,
-            columns=(['sample_name', 'sample_tag'] + other_features
-                     + marker_headers))
+    def get_cells_in_bbox(self, sample=None, name=None, tag=None,
+                          bbox=None, **kwargs):
+        """ Retrieve cells of a sample whose centroid is in a bounding
+        box, using the spatial index `ix_cell_centroid`.
 
-        if to_path:
-            df.to_csv(to_path, **kwargs)
+        Parameters
+        ----------
+        sample: `Sample` object or int.
+        name: str or None.
+        tag: str or None.
+        bbox: tuple of 4 numbers.
+            `(x_min, y_min, x_max, y_max)`, inclusive.
+        kwargs: Key words arguments
+            Used in `get_cells_for_sample`.
 
-        return df
+        Returns
+        -------
+        The same as `get_cells_for_sample`.
+        """
+        if bbox is None:
+            raise ValueError("Argument `bbox` is required!")
+        return self.get_cells_for_sample(sample=sample, name=name, tag=tag,
+                                         bbox=bbox, **kwargs)
+
+    def get_cells_in_radius(self, sample=None, name=None, tag=None,
+                            center=None, radius=None, **kwargs):
+        """ Retrieve cells of a sample whose centroid is within a radius
+        from a point, using the spatial index `ix_cell_centroid`.
+
+        Parameters
+        ----------
+        sample: `Sample` object or int.
+        name: str or None.
+        tag: str or None.
+        center: tuple of 2 numbers.
+            `(x, y)`.
+        radius: number.
+        kwargs: Key words arguments
+            Used in `get_cells_for_sample`.
+
+        Returns
+        -------
+        The same as `get_cells_for_sample`.
+        """
+        if center is None or radius is None:
+            raise ValueError("Arguments `center` and `radius` are "
+                             "required!")
+        return self.get_cells_for_sample(sample=sample, name=name, tag=tag,
+                                         center=center, radius=radius,
+                                         **kwargs)
 
     def get_sample_db_keys(self, sample=None, name=None, tag=None):
         """ get a Sample object
@@ -703,21 +1530,60 @@ class CycSession(Session):
         if not isinstance(sample, (int, Sample, type(None))):
             raise ValueError("The argument `sample` was provided, but it "
                              "was not a valid Sample object!")
-        if not isinstance(sample, Sample):
-            sample = self.get_sample(id=sample, name=name, tag=tag)
-        rval = self.query(Cell.features) \
-            .filter(Cell.sample_id == sample.id).first()
-
-        rval = list(rval[0].keys())
+        rval = [x.db_key for x in self.get_sample_feature_manifest(
+            sample, name=name, tag=tag)]
         rval = sorted(rval, key=lambda x: DB_Key(self, x, anti_sensitive=True))
         return rval
 
+    def get_sample_feature_manifest(self, sample=None, name=None, tag=None):
+        """ get the marker feature manifest of a sample.
+
+        Parameters
+        ----------
+        sample: int, Sample object or None.
+            Index of sample or a Sample object.
+            Ignoring `name` and `tag` if this one is provided.
+        name: str or None.
+            Name of sample, ignoring cases.
+        tag: str or None.
+            Tag of the sample, ignoring cases.
+
+        Returns
+        -------
+        List of Sample_Feature objects, in the order of ingestion.
+        """
+        if not isinstance(sample, (int, Sample, type(None))):
+            raise ValueError("The argument `sample` was provided, but it "
+                             "was not a valid Sample object!")
+        if isinstance(sample, Sample):
+            sample_id = sample.id
+        elif sample is not None:
+            sample_id = sample
+        else:
+            sample_id = self.get_sample_id(dict(name=name, tag=tag))
+
+        return self.query(Sample_Feature) \
+            .filter(Sample_Feature.sample_id == sample_id) \
+            .order_by(Sample_Feature.position).all()
+
     def get_cells_from_samples(self, samples=None, names=None, tags=None,
                                marker_filter='intersection',
                                fluor_sensitive=True,
                                anti_sensitive=False,
                                keep_duplicates='keep',
                                to_path=None,
+                               chunksize=None,
+                               exporter='pandas',
+                               to_parquet=None,
+                               marker_dtype='float64',
+                               markers=None,
+                               features=None,
+                               mask_types=None,
+                               filters=None,
+                               sample_fraction=None,
+                               max_cells_per_sample=None,
+                               seed=None,
+                               workers=None,
                                **kwargs):
         """ Retrieve all cells data for a list of samples and convert to
             pandas DataFrame.
@@ -742,73 +1608,691 @@ class CycSession(Session):
             For markers.
         to_path: str, default is None.
             If provided, this is the path to save the cells data.
+        chunksize: int or None.
+            If provided, cells are streamed from a server-side cursor in
+            chunks of this many rows, so the memory usage is bounded.
+        exporter: str, default is 'pandas'.
+            One of ['pandas', 'copy']. 'copy' streams the query result
+            into `to_path` with PostgreSQL `COPY ... TO STDOUT`, without
+            loading any row in Python. It requires `to_path` and doesn't
+            write the index column.
+        to_parquet: str, default is None.
+            If provided, this is the directory to save the cells data as
+            a Parquet dataset partitioned by `sample_name` and
+            `sample_tag`, streamed in chunks of `chunksize` rows. Marker
+            columns are float32.
+        marker_dtype: str, default is 'float64'.
+            The dtype of marker columns in DataFrame, 'float64' or
+            'float32'. Other features are float64 and `sample_cell_id`
+            is int64.
+        markers: list of str or None.
+            Marker names or aliases to export, e.g., ['CD45', 'cd-3'].
+            See `select_db_keys`. Default is all markers.
+        features: list of str or None.
+            Non-marker features to export, e.g., ['x_centroid', 'Area'].
+            `sample_cell_id` is always exported. Default is all.
+        mask_types: list of str or None.
+            Subset of ['cell_masks', 'nuclei_masks'] to export. Default
+            is all.
+        filters: str, list of str or None.
+            Gating filters run in database, e.g.,
+            'CD3__cell_masks > 500 & area < 200'. See `compile_filters`.
+            Multiple filters are combined by `and`.
+        sample_fraction: float or None.
+            If provided, a random subset of about this fraction of cells,
+            0 < sample_fraction <= 1, is exported from each sample.
+        max_cells_per_sample: int or None.
+            If provided, at most this many random cells are exported
+            from each sample.
+        seed: int or None.
+            Seed of the random sampling. The same seed selects the same
+            cells. Default is a random seed.
+        workers: int or None.
+            If provided, each sample is queried and decoded in one of
+            `workers` threads, over its own connection from the engine
+            pool, and the frames are concatenated in the order of
+            samples by name and tag, the same as the serial query. Only
+            for the 'pandas' exporter without `chunksize`/`to_parquet`.
+            Capped by the size of the engine pool.
         kwargs: Key words arguments
             Used in pandas dataframe `to_csv`.
 
         Returns
         -------
-        pandas DataFrame object.
+        pandas DataFrame object. If `chunksize` is provided, an iterator
+        of DataFrame objects instead, or None with `to_path`, in which
+        case the chunks are written to the file one by one. None if
+        `exporter` is 'copy' or `to_parquet` is provided.
+
+        With the session's `cells_cache`, a pandas DataFrame result is
+        cached under the samples with their `entry_at`, and all other
+        arguments except `to_path` and `workers`. Random sampling without
+        a `seed` is never cached.
         """
-        if not isinstance(samples, (Iterable, type(None))):
-            raise ValueError("The samples provided, `{samples}`, are not "
-                             "iterable or None.")
-
         if marker_filter not in ('intersection', 'union'):
             raise ValueError("Argument `marker_filter` must be one of "
                              "['intersection', 'union'], but got "
                              "`{}`!".format(marker_filter))
+        if workers is not None:
+            if not isinstance(workers, int) or workers < 1:
+                raise ValueError("Argument `workers` must be a positive "
+                                 "integer!")
+            if exporter != 'pandas' or chunksize or to_parquet:
+                raise ValueError("Argument `workers` only works with the "
+                                 "'pandas' exporter, without `chunksize` "
+                                 "or `to_parquet`!")
+            if marker_dtype not in ('float64', 'float32'):
+                raise ValueError("Argument `marker_dtype` must be one of "
+                                 "['float64', 'float32'], but got "
+                                 "`{}`!".format(marker_dtype))
+
+        samples = self.resolve_samples(samples, names, tags)
+        sample_ids = [sample.id for sample in samples]
+
+        cache_key = None
+        if self.cells_cache is not None and exporter == 'pandas' \
+                and not chunksize and not to_parquet and (
+                    seed is not None or (sample_fraction is None
+                                         and max_cells_per_sample is None)):
+            cache_key = self.cells_cache.make_key(dict(
+                samples=[(x.id, x.entry_at) for x in samples],
+                marker_filter=marker_filter, fluor_sensitive=fluor_sensitive,
+                anti_sensitive=anti_sensitive,
+                keep_duplicates=keep_duplicates, markers=markers,
+                features=features, mask_types=mask_types, filters=filters,
+                sample_fraction=sample_fraction,
+                max_cells_per_sample=max_cells_per_sample, seed=seed,
+                marker_dtype=marker_dtype))
+            df = self.cells_cache.get(cache_key)
+            if df is not None:
+                if to_path:
+                    df.to_csv(to_path, **kwargs)
+                return df
+
+        feature_lists = list(self.get_samples_db_keys(samples).values())
+        feature_list = fuse_db_keys(self, feature_lists,
+                                    marker_filter=marker_filter,
+                                    fluor_sensitive=fluor_sensitive,
+                                    anti_sensitive=anti_sensitive,
+                                    keep_duplicates=keep_duplicates)
+        cell_columns, columns = self._get_cell_columns(
+            feature_list, features=features, markers=markers,
+            mask_types=mask_types)
+
+        query = self.query(Sample.name, Sample.tag, *cell_columns)\
+            .join(Sample, Cell.sample)
+        if filters:
+            query = query.filter(self.compile_filters(filters))
+        columns = ['sample_name', 'sample_tag'] + columns
+
+        if workers is not None:
+            if seed is None:
+                seed = random.randrange(2 ** 31)
+            queries = [
+                self._sample_cells(
+                    query.filter(Cell.sample_id == sample_id)
+                    .order_by(Cell.sample_cell_id),
+                    sample_fraction=sample_fraction,
+                    max_cells_per_sample=max_cells_per_sample, seed=seed)
+                for sample_id in self._sort_sample_ids(sample_ids)]
+            df = self._fetch_cells_parallel(queries, columns, workers,
+                                            marker_dtype=marker_dtype)
+        else:
+            query = query.filter(Cell.sample_id.in_(sample_ids)) \
+                .order_by(Sample.name, Sample.tag, Cell.sample_cell_id)
+            query = self._sample_cells(
+                query, sample_fraction=sample_fraction,
+                max_cells_per_sample=max_cells_per_sample, seed=seed)
+            if cache_key is None:
+                return self._export_cells(
+                    query, columns, to_path=to_path, chunksize=chunksize,
+                    exporter=exporter, to_parquet=to_parquet,
+                    marker_dtype=marker_dtype, **kwargs)
+            df = self._export_cells(query, columns,
+                                    marker_dtype=marker_dtype)
+
+        if cache_key is not None:
+            self.cells_cache.put(cache_key, df, sample_ids)
+        if to_path:
+            df.to_csv(to_path, **kwargs)
+        return df
+
+    def get_feature_stats(self, samples=None, names=None, tags=None,
+                          markers=None, mask_types=None, merge=False):
+        """ Load the precomputed stats of marker features, without
+        scanning cells.
+
+        Parameters
+        ----------
+        samples: iterable of `Sample` objects or ints.
+            If int, these are the indices of samples in database.
+            Ignoring `name` and `tag` if this one is provided.
+        names: list/tuple of str or None.
+            Name of the sample, ignoring cases.
+        tags: list/tuple of str or None.
+            Tag of the sample, ignoring cases.
+        markers: list of str or None.
+            Marker names or aliases. See `select_db_keys`.
+        mask_types: list of str or None.
+            Subset of ['cell_masks', 'nuclei_masks']. Default is all.
+        merge: bool, default is False.
+            Whether to merge the stats of the same key over the samples,
+            including the quantile sketches.
+
+        Returns
+        -------
+        Dict of `Feature_Stats` objects, in `(sample_id, db_key): stats`
+        format, or `db_key: stats` if `merge` is True.
+        """
+        samples = self.resolve_samples(samples, names, tags)
+        rows = self.query(Sample_Feature_Stats) \
+            .filter(Sample_Feature_Stats.sample_id.in_(
+                [sample.id for sample in samples])) \
+            .order_by(Sample_Feature_Stats.sample_id,
+                      Sample_Feature_Stats.id).all()
+        keys = set(self.select_db_keys({x.db_key for x in rows},
+                                       markers=markers,
+                                       mask_types=mask_types))
+
+        rval = {}
+        for row in rows:
+            if row.db_key not in keys:
+                continue
+            stats = _row_to_feature_stats(row)
+            if not merge:
+                rval[(row.sample_id, row.db_key)] = stats
+            elif row.db_key in rval:
+                rval[row.db_key].merge(stats)
+            else:
+                rval[row.db_key] = stats
+        return rval
+
+    def iter_cells(self, samples=None, names=None, tags=None,
+                   batch_size=10000, cursor=None,
+                   marker_filter='intersection', fluor_sensitive=True,
+                   anti_sensitive=False, keep_duplicates='keep',
+                   markers=None, features=None, mask_types=None,
+                   filters=None, marker_dtype='float64'):
+        """ Iterate over cells of samples in DataFrames of `batch_size`
+        rows, in the order of `(sample_id, sample_cell_id, id)`, where
+        cells without `sample_cell_id` come last in a sample.
+
+        Each batch continues from the last cell of the previous batch,
+        i.e. keyset pagination, which is a range scan of index
+        `ix_cell_sample_cell_id` in the sample partition. No cursor or
+        transaction is held between batches. The cell `id` breaks ties,
+        so NULL or duplicate `sample_cell_id` are never skipped.
+
+        Parameters
+        ----------
+        samples, names, tags:
+            See `get_cells_from_samples`.
+        batch_size: int, default is 10000.
+            The number of cells per DataFrame.
+        cursor: str or None.
+            The `cursor` of a batch yielded before, to resume the
+            iteration after that batch, with the same arguments.
+        marker_filter, fluor_sensitive, anti_sensitive, keep_duplicates:
+            See `get_cells_from_samples`.
+        markers, features, mask_types, filters, marker_dtype:
+            See `get_cells_from_samples`.
+
+        Returns
+        -------
+        An iterator of pandas DataFrame objects, having the same columns
+        as `get_cells_from_samples`. `df.attrs['cursor']` is the token to
+        resume from after the DataFrame.
+        """
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError("Argument `batch_size` must be a positive "
+                             "integer!")
+        samples = self.resolve_samples(samples, names, tags)
+        sample_ids = sorted({sample.id for sample in samples})
+        fingerprint = hash_sample_ids(sample_ids)
+        position = None
+        if cursor:
+            position = decode_cursor(cursor, fingerprint)
+
+        feature_lists = list(self.get_samples_db_keys(samples).values())
+        feature_list = fuse_db_keys(self, feature_lists,
+                                    marker_filter=marker_filter,
+                                    fluor_sensitive=fluor_sensitive,
+                                    anti_sensitive=anti_sensitive,
+                                    keep_duplicates=keep_duplicates)
+        cell_columns, columns = self._get_cell_columns(
+            feature_list, features=features, markers=markers,
+            mask_types=mask_types)
+        columns = ['sample_name', 'sample_tag'] + columns
+
+        # the keys of cells, last in each row
+        query = self.query(Sample.name, Sample.tag, *cell_columns,
+                           Cell.sample_id, Cell.sample_cell_id, Cell.id) \
+            .join(Sample, Cell.sample)
+        if filters:
+            query = query.filter(self.compile_filters(filters))
+        dtypes = self._get_export_dtypes(query, marker_dtype=marker_dtype)
+        query = self._cast_export_query(query)
+        columns = columns + ['_sample_id', '_sample_cell_id', '_id']
+
+        rows = self._iter_cells_rows(query, sample_ids, batch_size, position)
+        return self._iter_cells_batches(rows, columns, dtypes, batch_size,
+                                        fingerprint)
+
+    def _iter_cells_batches(self, rows, columns, dtypes, batch_size,
+                            fingerprint):
+        """ helper function for `iter_cells`. Group rows into DataFrames.
+        """
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return
+            df = rows_to_frame(batch, columns, dtypes=dtypes)
+            df.drop(columns=columns[-3:], inplace=True)
+            position = tuple(batch[-1][-3:])
+            df.attrs['cursor'] = encode_cursor(position, fingerprint)
+            yield df
+            if len(batch) < batch_size:
+                return
+
+    def _iter_cells_rows(self, query, sample_ids, page_size, position=None):
+        """ helper function for `iter_cells`. Iterate over rows after
+        `position`, `(sample_id, sample_cell_id, id)`, sample by sample.
+        In each sample, cells having `sample_cell_id` are paged on
+        `(sample_cell_id, id)`, then the others on `id`.
+        """
+        for sample_id in sample_ids:
+            if position and sample_id < position[0]:
+                continue
+            sample_query = query.filter(Cell.sample_id == sample_id)
+            stages = [
+                [(Cell.sample_cell_id, Cell.id),
+                 sample_query.filter(Cell.sample_cell_id.isnot(None)), None],
+                [(Cell.id,),
+                 sample_query.filter(Cell.sample_cell_id.is_(None)), None]]
+            if position and sample_id == position[0]:
+                if position[1] is None:
+                    stages = stages[1:]
+                    stages[0][2] = (position[2],)
+                else:
+                    stages[0][2] = position[1:]
+
+            for keys, stage_query, after in stages:
+                while True:
+                    page = stage_query
+                    if after is not None:
+                        page = page.filter(tuple_(*keys) > tuple_(*after))
+                    page = page.order_by(*keys).limit(page_size).all()
+                    yield from page
+                    if len(page) < page_size:
+                        break
+                    after = tuple(page[-1][-len(keys):])
+
+    def summarize_samples(self, samples=None, names=None, tags=None,
+                          markers=None, mask_types=None,
+                          stats=('count', 'mean', 'std', 'median'),
+                          filters=None):
+        """ Compute summary statistics of markers per sample in database.
+        Only the statistics are transferred, not the cells.
+
+        Parameters
+        ----------
+        samples: iterable of `Sample` objects or ints.
+            If int, these are the indices of samples in database.
+            Ignoring `name` and `tag` if this one is provided.
+        names: list/tuple of str or None.
+            Name of the sample, ignoring cases.
+        tags: list/tuple of str or None.
+            Tag of the sample, ignoring cases.
+        markers: list of str or None.
+            Marker names or aliases. See `select_db_keys`. Default is all
+            markers of the samples.
+        mask_types: list of str or None.
+            Subset of ['cell_masks', 'nuclei_masks']. Default is all.
+        stats: list of str.
+            Any of ['count', 'mean', 'std', 'min', 'max', 'median'] and
+            percentiles like 'p5' or 'p99.9'. `count` is the number of
+            cells having the marker. `std` is the sample standard
+            deviation. Percentiles are interpolated.
+        filters: str, list of str or None.
+            Gating filters on cells. See `compile_filters`.
+
+        Returns
+        -------
+        pandas DataFrame object, one row per sample and marker, having
+        columns `sample_name`, `sample_tag`, `marker` and one for each
+        of `stats`.
+        """
+        if isinstance(stats, str):
+            stats = [stats]
+        if not stats:
+            raise ValueError("Argument `stats` can't be empty!")
+        samples = self.resolve_samples(samples, names, tags)
+
+        sample_keys = {k: set(v) for k, v in
+                       self.get_samples_db_keys(samples).items()}
+        db_keys = sorted(set.union(*sample_keys.values()),
+                         key=lambda x: DB_Key(self, x, anti_sensitive=True))
+        db_keys = self.select_db_keys(db_keys, markers=markers,
+                                      mask_types=mask_types)
+        columns = ['sample_name', 'sample_tag', 'marker'] + list(stats)
+        if not db_keys:
+            return DataFrame(columns=columns)
+
+        keys = func.unnest(cast(array(db_keys), ARRAY(String))).alias('k')
+        key = column('k')
+        value = cast(Cell.features.op('->>')(key), Float)
+        aggregates = [_summary_stat(value, x) for x in stats]
+
+        sample_ids = [sample.id for sample in samples]
+        query = self.query(Cell.sample_id, key, *aggregates) \
+            .select_from(Cell) \
+            .join(keys, literal_column('true')) \
+            .filter(Cell.sample_id.in_(sample_ids)) \
+            .group_by(Cell.sample_id, key)
+        if filters:
+            query = query.filter(self.compile_filters(filters))
+        results = {(x[0], x[1]): x[2:] for x in query.all()}
+
+        dtypes = [None] * 3 + ['int64' if x == 'count' else 'float64'
+                               for x in stats]
+        headers = {k: DB_Key(self, k, anti_sensitive=True).to_header()
+                   for k in db_keys}
+        rows = []
+        for sample in samples:
+            for k in db_keys:
+                if k not in sample_keys[sample.id]:
+                    continue
+                values = results.get((sample.id, k))
+                if values is None:
+                    # no cell has the marker, or none passed the filters
+                    values = [0 if x == 'count' else None for x in stats]
+                rows.append((sample.name, sample.tag, headers[k], *values))
+
+        return rows_to_frame(rows, columns, dtypes=dtypes)
+
+    def _sort_sample_ids(self, sample_ids):
+        """ helper function to sort samples by name and tag in database,
+        in the collation of the `ORDER BY` of the cells query.
+        """
+        return [x for x, in self.query(Sample.id)
+                .filter(Sample.id.in_(sample_ids))
+                .order_by(Sample.name, Sample.tag)]
+
+    def _fetch_cells_parallel(self, queries, columns, workers,
+                              marker_dtype='float64'):
+        """ helper function for cells export. Run the queries in a pool
+        of threads, each with its own session, decode the results into
+        DataFrames independently and concatenate them in order.
+        """
+        dtypes = self._get_export_dtypes(queries[0],
+                                         marker_dtype=marker_dtype)
+        queries = [self._cast_export_query(x) for x in queries]
+        bind = self.get_bind()
+
+        # more threads than pooled connections just wait on checkout; this
+        # session holds one connection as well
+        pool_limit = _pool_limit(bind)
+        if pool_limit is not None and workers > pool_limit - 1:
+            workers = max(pool_limit - 1, 1)
+            log.info("Argument `workers` is capped to %d by the connection "
+                     "pool." % workers)
+
+        def fetch(query):
+            with CycSession(bind=bind) as session:
+                return rows_to_frame(query.with_session(session).all(),
+                                     columns, dtypes=dtypes)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            frames = list(executor.map(fetch, queries))
+        log.info("Fetched cells of %d samples in %d threads."
+                 % (len(frames), workers))
+
+        rval = pd.concat(frames, ignore_index=True)
+        # keep the dtypes of an empty result
+        return rval if rval.shape[0] else frames[0]
+
+    def resolve_samples(self, samples=None, names=None, tags=None,
+                        ignore_missing=False):
+        """ Get Sample objects in batch, by ids in one query or by names
+        and tags in one query joining them as a table.
+
+        Parameters
+        ----------
+        samples: iterable of `Sample` objects or ints.
+            If int, these are the indices of samples in database.
+            Ignoring `name` and `tag` if this one is provided.
+        names: list/tuple of str or None.
+            Name of the sample, ignoring cases.
+        tags: list/tuple of str or None.
+            Tag of the sample, ignoring cases. Missing tags are None.
+        ignore_missing: bool, default is False.
+            Whether to skip the samples not found, instead of raising
+            ValueError.
+
+        Returns
+        -------
+        List of Sample objects, in the requested order.
+        """
+        if not isinstance(samples, (Iterable, type(None))):
+            raise ValueError("The samples provided, `{samples}`, are not "
+                             "iterable or None.")
 
         if samples:
-            if isinstance(samples[0], int):
-                samples = [self.get_sample(id) for id in samples]
-            elif not isinstance(samples[0], Sample):
+            samples = list(samples)
+            if all(isinstance(x, Sample) for x in samples):
+                return samples
+            if not all(isinstance(x, int) for x in samples):
                 raise ValueError(
                     "The element of `samples` must be either int or Sample "
-                    "object, but got `{samples[0]}`!")
+                    "object, but got `{}`!".format(samples))
+            found = {x.id: x for x in self.query(Sample)
+                     .filter(Sample.id.in_(samples))}
+            rval = [found.get(x) for x in samples]
+            requested = ['id={}'.format(x) for x in samples]
         elif names:
             if not isinstance(names, (list, tuple)):
                 raise ValueError("The argument `names` requires list or tuple "
                                  "data type! `{names}` was not valid!")
-            if not tags:
-                tags = [None]
-            if len(tags) < len(names):
-                tags.extend([None] * (len(names) - len(tags)))
-            samples = [self.get_sample(name=name, tag=tag)
-                       for name, tag in zip(names, tags)]
+            tags = list(tags or [])
+            tags.extend([None] * (len(names) - len(tags)))
+            tags = tags[:len(names)]
+
+            requested_samples = text(
+                "SELECT * FROM unnest(CAST(:names AS text[]), "
+                "CAST(:tags AS text[])) WITH ORDINALITY AS r(name, tag, idx)")\
+                .bindparams(names=list(names), tags=tags)\
+                .columns(column('name', String), column('tag', String),
+                         column('idx', Integer)).alias('r')
+            # the same matching as `get_sample`
+            found = self.query(requested_samples.c.idx, Sample) \
+                .select_from(requested_samples) \
+                .join(Sample, and_(
+                    func.lower(Sample.name) ==
+                    func.lower(requested_samples.c.name),
+                    Sample.tag.isnot_distinct_from(requested_samples.c.tag)
+                    | (func.lower(Sample.tag) == func.lower(func.coalesce(
+                        requested_samples.c.tag, 'None'))))) \
+                .order_by(requested_samples.c.idx, Sample.id).all()
+            found = dict(reversed(found))
+            rval = [found.get(i) for i in range(1, len(names) + 1)]
+            requested = ['name={}, tag={}'.format(name, tag)
+                         for name, tag in zip(names, tags)]
         else:
             raise ValueError("One of the `samples` and `names` must be "
                              "provided!")
 
-        sample_ids = [sample.id for sample in samples]
-        other_features = sorted(list(OTHER_FEATHERS.keys()),
-                                key=column_sort_key)
-        cell_columns = [getattr(Cell, ftr) for ftr in other_features]
-        feature_lists = [self.get_sample_db_keys(sample) for sample in samples]
-        feature_list = fuse_db_keys(self, feature_lists,
-                                    marker_filter=marker_filter,
-                                    fluor_sensitive=fluor_sensitive,
-                                    anti_sensitive=anti_sensitive,
-                                    keep_duplicates=keep_duplicates)
-        cell_columns += [Cell.features[key] for key in feature_list]
+        missing = [x for x, sample in zip(requested, rval) if sample is None]
+        if missing:
+            msg = "No matching sample was found for: {}!".format(
+                '; '.join(missing))
+            if not ignore_missing:
+                raise ValueError(msg)
+            log.warning(msg)
+        rval = [x for x in rval if x is not None]
+        log.info("Resolved %d samples." % len(rval))
+        return rval
 
-        data = self.query(Sample.name, Sample.tag, *cell_columns)\
-            .join(Sample) \
-            .filter(Cell.sample_id.in_(sample_ids)) \
-            .order_by(Sample.name, Sample.tag, Cell.sample_cell_id) \
-            .all()
+    def get_samples_db_keys(self, samples):
+        """ get the marker feature keys of multiple samples in one query.
 
-        marker_headers = [DB_Key(self, k, anti_sensitive=True).to_header()
-                          for k in feature_list]
+        Parameters
+        ----------
+        samples: list of Sample objects or ints.
 
-        df = pd.DataFrame(
-            data,
-            columns=(['sample_name', 'sample_tag'] + other_features
-                     + marker_headers))
+        Returns
+        -------
+        Dict, in `sample_id: list of db_keys` format. The keys are sorted
+        the same as `get_sample_db_keys`.
+        """
+        sample_ids = [x.id if isinstance(x, Sample) else x for x in samples]
+        rval = {x: [] for x in sample_ids}
+        manifests = self.query(Sample_Feature.sample_id,
+                               Sample_Feature.db_key) \
+            .filter(Sample_Feature.sample_id.in_(sample_ids)) \
+            .order_by(Sample_Feature.sample_id, Sample_Feature.position)
+        for sample_id, db_key in manifests:
+            rval[sample_id].append(db_key)
+        for sample_id, db_keys in rval.items():
+            rval[sample_id] = sorted(
+                db_keys, key=lambda x: DB_Key(self, x, anti_sensitive=True))
+        return rval
 
-        if to_path:
-            df.to_csv(to_path, **kwargs)
+    def _export_cells(self, query, columns, to_path=None, chunksize=None,
+                      exporter='pandas', to_parquet=None,
+                      marker_dtype='float64', **kwargs):
+        """ helper function for cells export. Run the query into
+        DataFrame(s) and optionally save to csv or parquet.
+        """
+        if exporter not in CELL_EXPORTERS:
+            raise ValueError("Argument `exporter` must be one of {}, but got "
+                             "`{}`!".format(list(CELL_EXPORTERS), exporter))
+        if marker_dtype not in ('float64', 'float32'):
+            raise ValueError("Argument `marker_dtype` must be one of "
+                             "['float64', 'float32'], but got "
+                             "`{}`!".format(marker_dtype))
+        if to_parquet:
+            if to_path or exporter != 'pandas':
+                raise ValueError("Argument `to_parquet` can't be used with "
+                                 "`to_path` or the 'copy' exporter!")
+            dtypes = self._get_export_dtypes(query, marker_dtype='float32')
+            frames = self._iter_cells_frames(
+                self._cast_export_query(query), columns,
+                chunksize or EXPORT_CHUNKSIZE, dtypes)
+            write_parquet_dataset(
+                frames, to_parquet, ['sample_name', 'sample_tag'],
+                dtypes={name: dtype or 'string'
+                        for name, dtype in zip(columns, dtypes)})
+            return
+        if exporter == 'copy':
+            if not to_path:
+                raise ValueError("Argument `to_path` is required by the "
+                                 "'copy' exporter!")
+            if kwargs:
+                raise ValueError("The 'copy' exporter doesn't support "
+                                 "`to_csv` arguments: {}!".format(
+                                     list(kwargs)))
+            return self._copy_cells_to(query, columns, to_path)
+
+        dtypes = self._get_export_dtypes(query, marker_dtype=marker_dtype)
+        query = self._cast_export_query(query)
+        if not chunksize:
+            df = rows_to_frame(query.all(), columns, dtypes=dtypes)
+            if to_path:
+                df.to_csv(to_path, **kwargs)
+            return df
+
+        frames = self._iter_cells_frames(query, columns, chunksize, dtypes)
+        if not to_path:
+            return frames
+
+        header = kwargs.pop('header', True)
+        mode = kwargs.pop('mode', 'w')
+        count = 0
+        for df in frames:
+            df.to_csv(to_path, header=header, mode=mode, **kwargs)
+            header, mode = False, 'a'
+            count += df.shape[0]
+        if not count:
+            pd.DataFrame(columns=columns).to_csv(
+                to_path, header=header, mode=mode, **kwargs)
+        log.info("Exported %d cells to `%s`." % (count, to_path))
+
+    def _get_export_dtypes(self, query, marker_dtype='float64'):
+        """ helper function for cells export. Map the query columns to
+        dtypes: markers to `marker_dtype`, Numeric features to float64,
+        integers to int64 and the rest to object (None).
+        """
+        rval = []
+        for desc in query.column_descriptions:
+            if isinstance(desc['type'], JSONB):
+                rval.append(marker_dtype)
+            elif isinstance(desc['type'], Integer):
+                rval.append('int64')
+            elif isinstance(desc['type'], Numeric):
+                rval.append('float64')
+            else:
+                rval.append(None)
+        return rval
 
-        return df
+    def _cast_export_query(self, query):
+        """ helper function for cells export. Cast the Numeric columns and
+        JSONB features to double precision in SQL, so psycopg2 returns
+        floats instead of Decimal objects.
+        """
+        entities = []
+        for desc in query.column_descriptions:
+            expr = desc['expr']
+            if isinstance(desc['type'], JSONB):
+                expr = cast(expr.astext, Float)
+            elif isinstance(desc['type'], Numeric):
+                expr = cast(expr, Float)
+            entities.append(expr)
+        return query.with_entities(*entities)
+
+    def _copy_cells_to(self, query, columns, to_path):
+        """ helper function for cells export, using
+        `COPY (SELECT ...) TO STDOUT`. JSONB features are exported as
+        text and the columns are renamed to `columns`.
+        """
+        entities = []
+        for desc, name in zip(query.column_descriptions, columns):
+            expr = desc['expr']
+            if isinstance(expr.type, JSONB):
+                expr = expr.astext
+            entities.append(expr.label(name))
+        statement = query.with_entities(*entities).statement.compile(
+            dialect=self.get_bind().dialect,
+            compile_kwargs={'literal_binds': True})
+        sql = "COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)".format(
+            statement)
+
+        cursor = self.connection().connection.cursor()
+        try:
+            if isinstance(to_path, str):
+                with open(to_path, 'w') as fp:
+                    cursor.copy_expert(sql, fp)
+            else:
+                cursor.copy_expert(sql, to_path)
+            count = cursor.rowcount
+        finally:
+            cursor.close()
+        log.info("Copied %d cells to `%s`." % (count, to_path))
+
+    def _iter_cells_frames(self, query, columns, chunksize, dtypes=None):
+        """ helper function for cells export. Fetch rows from a named
+        server-side cursor and yield DataFrames of `chunksize` rows.
+        The index continues over chunks, as if it were one DataFrame.
+        """
+        rows = iter(query.yield_per(chunksize))
+        start = 0
+        while True:
+            batch = list(itertools.islice(rows, chunksize))
+            if not batch:
+                return
+            yield rows_to_frame(
+                batch, columns, dtypes=dtypes,
+                index=pd.RangeIndex(start, start + len(batch)))
+            start += len(batch)
 
 
 def column_sort_key(column):
@@ -821,24 +2305,159 @@ def column_sort_key(column):
     return column
 
 
+def parse_db_key(key):
+    """ Split a `Cell.features` key, like `56_cl`, into marker id and
+    mask type.
+
+    Returns
+    -------
+    Tuple of (int, str), like (56, 'cell_masks').
+    """
+    marker_id, _, mask = key.partition('_')
+    if mask not in MASK_TYPES or not marker_id.isdigit():
+        raise ValueError(f"Unrecognized dabase json key: {key}!")
+    return int(marker_id), MASK_TYPES[mask]
+
+
+def _marker_matches(marker, requested):
+    """ Whether `marker` is covered by the `requested` marker, i.e.,
+    having the same name, and the same fluor, anti and duplicate where
+    `requested` has them, ignoring cases.
+    """
+    for field in ('name', 'fluor', 'anti', 'duplicate'):
+        value = (getattr(requested, field) or '').lower()
+        if value and value != (getattr(marker, field) or '').lower():
+            return False
+    return True
+
+
+def _pool_limit(bind):
+    """ The max number of connections of the engine pool,
+    `pool_size + max_overflow`, or None if unbounded.
+    """
+    pool = getattr(bind, 'pool', None)
+    if not isinstance(pool, QueuePool):
+        return None
+    max_overflow = pool._max_overflow
+    if max_overflow < 0:
+        return None
+    return pool.size() + max_overflow
+
+
+def hash_sample_ids(sample_ids):
+    """ A short fingerprint of sample ids, to check a cursor token is
+    used on the same samples.
+    """
+    return format(zlib.crc32(','.join(
+        str(x) for x in sorted(sample_ids)).encode()), '08x')
+
+
+def encode_cursor(position, fingerprint):
+    """ Make the cursor token of `iter_cells`, which is URL-safe base64
+    of JSON.
+    """
+    data = json.dumps({'sample_id': position[0],
+                       'sample_cell_id': position[1],
+                       'id': position[2],
+                       'samples': fingerprint})
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor, fingerprint):
+    """ Parse a cursor token of `iter_cells`.
+
+    Returns
+    -------
+    Tuple of (sample_id, sample_cell_id, id). `sample_cell_id` may be
+    None.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        sample_cell_id = data['sample_cell_id']
+        if sample_cell_id is not None:
+            sample_cell_id = int(sample_cell_id)
+        position = (int(data['sample_id']), sample_cell_id, int(data['id']))
+        samples = data['samples']
+    except Exception:
+        raise ValueError(f"Invalid cursor token `{cursor}`!")
+    if samples != fingerprint:
+        raise ValueError("The cursor token was made for other samples!")
+    return position
+
+
+def _region_clause(bbox=None, center=None, radius=None):
+    """ Make the condition of cell centroids in a bounding box or a
+    circle, which is served by the GiST index `ix_cell_centroid`.
+    """
+    if bbox is not None:
+        if center is not None or radius is not None:
+            raise ValueError("Argument `bbox` can't be used with `center` "
+                             "and `radius`!")
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("Argument `bbox` must be `(x_min, y_min, "
+                             "x_max, y_max)`, but got `{}`!".format(bbox))
+        x_min, y_min, x_max, y_max = [float(x) for x in bbox]
+        return cell_centroid().op('<@')(func.box(
+            func.point(x_min, y_min), func.point(x_max, y_max)))
+
+    if center is None or radius is None:
+        raise ValueError("Arguments `center` and `radius` must be "
+                         "provided together!")
+    if len(center) != 2 or radius < 0:
+        raise ValueError("Argument `center` must be `(x, y)` and `radius`"
+                         " non-negative!")
+    x, y = [float(v) for v in center]
+    return cell_centroid().op('<@')(func.circle(func.point(x, y),
+                                                float(radius)))
+
+
+def _row_to_feature_stats(row):
+    """ Convert a Sample_Feature_Stats row to Feature_Stats object.
+    """
+    rval = Feature_Stats()
+    rval.count = row.count
+    rval.min, rval.max = row.min, row.max
+    rval.mean, rval.m2 = row.mean or 0.0, row.m2 or 0.0
+    if row.sketch:
+        rval.sketch = Quantile_Sketch.from_dict(row.sketch)
+    return rval
+
+
+def _summary_stat(value, stat):
+    """ Make the aggregate expression of a summary stat.
+    """
+    if stat == 'count':
+        return func.count(value)
+    if stat == 'mean':
+        return func.avg(value)
+    if stat == 'std':
+        return func.stddev_samp(value)
+    if stat == 'min':
+        return func.min(value)
+    if stat == 'max':
+        return func.max(value)
+    if stat == 'median':
+        return func.percentile_cont(0.5).within_group(value)
+    match = re.fullmatch(r'p(\d+(?:\.\d+)?)', str(stat))
+    if match and float(match.group(1)) <= 100:
+        return func.percentile_cont(
+            float(match.group(1)) / 100).within_group(value)
+    raise ValueError("Unsupported stat `{}`! Must be one of {} or a "
+                     "percentile like 'p25'.".format(stat,
+                                                     list(SUMMARY_STATS)))
+
+
 class DB_Key(object):
     def __init__(self, session, key, fluor_sensitive=True,
                  anti_sensitive=False, keep_duplicates='keep') -> None:
         self.session = session
         self.key = key
-        marker_id, mask_type = self.key.split('_')
-        self.marker_id = int(marker_id)
-        if mask_type == 'cl':
-            self.mask_type = 'cell_masks'
-        elif mask_type == 'nu':
-            self.mask_type = 'nuclei_masks'
-        else:
-            raise ValueError(f"Unrecognized dabase json key: {key}!")
-        marker = self.session.query(Marker).get(self.marker_id)
-        self.marker_comparator = Marker_Comparator(
-            marker, fluor_sensitive=fluor_sensitive,
+        self.marker_id, self.mask_type = parse_db_key(key)
+        self.marker_comparator = self.session.get_marker_comparator(
+            self.marker_id, fluor_sensitive=fluor_sensitive,
             anti_sensitive=anti_sensitive,
             keep_duplicates=keep_duplicates)
+        self._hash = self.marker_comparator.__hash__() + hash(self.mask_type)
 
     def __repr__(self) -> str:
         return f"<DB_Key('{self.key}')>"
@@ -862,7 +2481,7 @@ class DB_Key(object):
             False
 
     def __hash__(self) -> int:
-        return self.marker_comparator.__hash__() + hash(self.mask_type)
+        return self._hash
 
 
 def fuse_db_keys(session, key_lists, marker_filter='intersection',
@@ -897,22 +2516,17 @@ def fuse_db_keys(session, key_lists, marker_filter='intersection',
     if marker_filter == 'union':
         return key_list
 
-    ob_lists = [[DB_Key(session, key,
-                        fluor_sensitive=fluor_sensitive,
-                        anti_sensitive=anti_sensitive,
-                        keep_duplicates=keep_duplicates)
-                 for key in inner_list]
-                for inner_list in key_lists]
+    obs = {key: DB_Key(session, key,
+                       fluor_sensitive=fluor_sensitive,
+                       anti_sensitive=anti_sensitive,
+                       keep_duplicates=keep_duplicates)
+           for key in key_set}
 
-    ob_sets = [set(x) for x in ob_lists]
+    ob_sets = [set(obs[key] for key in inner_list)
+               for inner_list in key_lists]
     ob_set = set.intersection(*ob_sets)
 
     if keep_duplicates == 'keep':
-        key_list = [key for key in key_list
-                    if DB_Key(
-                        session, key,
-                        fluor_sensitive=fluor_sensitive,
-                        anti_sensitive=anti_sensitive,
-                        keep_duplicates=keep_duplicates) in ob_set]
+        key_list = [key for key in key_list if obs[key] in ob_set]
 
     return key_list
@@ -2,3 +2,7 @@ from ._dataframe import (CycDataFrame,
                          MarkerIncompatibilityError,
                          get_headers_categorized,
                          header_to_marker)
+from ._decoder import rows_to_frame
+from ._encoder import encode_features, to_copy_buffer
+from ._parquet import write_parquet_dataset
+from ._stats import Feature_Stats, Quantile_Sketch
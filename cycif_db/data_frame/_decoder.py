@@ -0,0 +1,57 @@
+""" Utils for building DataFrames from database query results
+"""
+import numpy as np
+import pandas as pd
+
+
+def rows_to_frame(rows, columns, dtypes=None, index=None):
+    """ Build a DataFrame column-wise from result rows, converting each
+    column into a NumPy array of its dtype at once, instead of inferring
+    dtypes over object columns.
+
+    Parameters
+    ----------
+    rows: list of tuples.
+        Result rows from database.
+    columns: list of str.
+        Column names.
+    dtypes: list of str or None.
+        One for each column, 'int64', 'float32', 'float64' or None for
+        object. NULLs become NaN in float columns. Int columns having
+        NULLs fall back to float64. Default is all object.
+    index: pandas Index or None.
+        Used in pandas DataFrame.
+
+    Returns
+    -------
+    pandas.DataFrame object.
+    """
+    if dtypes is None:
+        dtypes = [None] * len(columns)
+    if len(dtypes) != len(columns):
+        raise ValueError("The number of dtypes doesn't match the number of "
+                         "columns!")
+
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    arrays = {}
+    for i, (column, dtype) in enumerate(zip(values, dtypes)):
+        arrays[i] = _to_array(column, dtype)
+
+    df = pd.DataFrame(arrays, index=index)
+    df.columns = columns
+    return df
+
+
+def _to_array(values, dtype):
+    """ Convert a tuple of values into a NumPy array of `dtype`.
+    """
+    if dtype is None:
+        rval = np.empty(len(values), dtype=object)
+        rval[:] = values
+        return rval
+    if dtype == 'int64':
+        try:
+            return np.array(values, dtype=np.int64)
+        except TypeError:
+            dtype = 'float64'
+    return np.array(values, dtype=dtype)
@@ -0,0 +1,179 @@
+""" Utils for serializing quantification data into database formats
+"""
+import io
+import json
+import numpy as np
+
+from pandas import Series
+
+
+# Scaled values beyond this fall back to the column-wise string encoder,
+# which keeps the shortest float repr for them.
+MAX_FIXED_POINT = 10 ** 15
+
+
+def encode_features(data, keys=None, decimals=4):
+    """ Serialize marker columns into JSON text, one object per row.
+
+    Values are rounded to `decimals` and written as fixed-point numbers
+    by NumPy straight into a byte buffer of fixed-width rows, without
+    building a Python dict or float object per value. The padding of
+    the fixed-width slots is then dropped from each row, so the text is
+    as compact as `to_json`. NaN becomes `null`.
+
+    Parameters
+    ----------
+    data: pandas.DataFrame.
+        Marker intensities, one column per marker.
+    keys: list of str or None.
+        The JSON keys for the columns. Default is the column names.
+    decimals: int, default is 4.
+        Number of decimal places to round to.
+
+    Returns
+    -------
+    pandas Series of str.
+    """
+    if keys is None:
+        keys = [str(x) for x in data.columns]
+    if len(keys) != data.shape[1]:
+        raise ValueError("The number of keys doesn't match the number of "
+                         "columns!")
+    if not keys or not data.shape[0]:
+        return Series('{}', index=data.index, dtype=object)
+
+    values = data.to_numpy(dtype=np.float64)
+    isnan = np.isnan(values)
+    scaled = np.round(np.abs(np.where(isnan, 0., values)) * 10. ** decimals)
+    if decimals < 0 or not np.isfinite(scaled).all() \
+            or scaled.max() >= MAX_FIXED_POINT:
+        return _encode_features_by_column(data, keys, decimals)
+    negative = (values < 0) & (scaled > 0)
+    scaled = scaled.astype(np.uint32 if scaled.max() < 2 ** 32
+                           else np.uint64)
+
+    int_width = len(str(int(scaled.max()) // 10 ** decimals))
+    frac_width = decimals + 1 if decimals else 0
+    # one more for the minus sign
+    width = max(1 + int_width + frac_width, len('null'))
+
+    pieces = [(('{' if i == 0 else ',') + json.dumps(key) + ':')
+              .encode('ascii') for i, key in enumerate(keys)]
+    piece_width = max(len(x) for x in pieces)
+    # keys may contain whitespaces, so the padding is tracked by length
+    piece_keep = np.arange(piece_width) < np.array(
+        [[len(x)] for x in pieces])
+    pieces = np.frombuffer(b''.join(x.ljust(piece_width) for x in pieces),
+                           dtype=np.uint8).reshape(len(keys), piece_width)
+
+    n_rows, n_cols = values.shape
+    slot_width = piece_width + width
+    rows = np.empty((n_rows, n_cols * slot_width + 1), dtype=np.uint8)
+    slots = rows[:, :-1].reshape(n_rows, n_cols, slot_width)
+    slots[..., :piece_width] = pieces
+    _format_fixed_point(slots[..., piece_width:], scaled, negative, isnan,
+                        int_width, decimals)
+    rows[:, -1] = ord('}')
+
+    # drop the padding, numbers and `null` have no whitespaces
+    keep = rows != ord(' ')
+    keep[:, :-1].reshape(n_rows, n_cols, slot_width)[..., :piece_width] = \
+        piece_keep
+    ends = np.cumsum(keep.sum(axis=1)).tolist()
+    # `json.dumps` escapes non-ASCII characters in keys
+    buffer = memoryview(rows[keep])
+    return Series([str(buffer[start: end], 'ascii')
+                   for start, end in zip([0] + ends[:-1], ends)],
+                  index=data.index, dtype=object)
+
+
+def _format_fixed_point(fields, scaled, negative, isnan, int_width,
+                        decimals):
+    """ Write non-negative integers, which are values scaled by
+    `10 ** decimals`, as right-aligned ASCII decimals into `fields`,
+    a uint8 array in shape of (n_rows, n_cols, width). Leading zeros of
+    the integer part and trailing zeros of the fraction part, except the
+    first fraction digit, are written as whitespaces.
+    """
+    width = fields.shape[-1]
+    frac_width = decimals + 1 if decimals else 0
+    int_end = width - frac_width
+
+    # one contiguous plane per character position
+    planes = np.full((width,) + scaled.shape, ord(' '), dtype=np.uint8)
+    if decimals:
+        planes[int_end] = ord('.')
+
+    integer = scaled // 10 ** decimals
+    fraction = scaled - integer * 10 ** decimals
+    # position of the first significant digit of the integer part
+    int_start = np.full(scaled.shape, int_end - 1, dtype=np.int8)
+    for i in range(1, int_width):
+        int_start -= (integer >= 10 ** i)
+
+    for pos in range(width - 1, int_end, -1):
+        fraction = _write_digit(planes[pos], fraction)
+    # trailing zeros of the fraction part
+    for pos in range(width - 1, int_end + 1, -1):
+        trailing = planes[pos] == ord('0')
+        if pos < width - 1:
+            trailing &= planes[pos + 1] == ord(' ')
+        np.putmask(planes[pos], trailing, ord(' '))
+
+    for pos in range(int_end - 1, int_end - int_width - 1, -1):
+        leading = pos < int_start
+        integer = _write_digit(planes[pos], integer)
+        np.putmask(planes[pos], leading, ord(' '))
+
+    rows, cols = np.nonzero(negative)
+    planes[int_start[rows, cols] - 1, rows, cols] = ord('-')
+
+    fields[...] = planes.transpose(1, 2, 0)
+    fields[isnan] = np.frombuffer(b'null'.ljust(width), dtype=np.uint8)
+
+
+def _write_digit(plane, value):
+    """ Write the last digit of integers, in ASCII code, into `plane`.
+
+    Returns
+    -------
+    The rest digits.
+    """
+    rest = value // 10
+    np.add(value - rest * 10, ord('0'), out=plane, casting='unsafe')
+    return rest
+
+
+def _encode_features_by_column(data, keys, decimals):
+    """ Fallback of `encode_features`, using pandas string concatenation.
+    """
+    data = data.round(decimals=decimals)
+
+    rval = None
+    for i, key in enumerate(keys):
+        column = data.iloc[:, i]
+        values = column.astype(str).where(column.notna(), 'null')
+        item = ('{' if i == 0 else ',') + json.dumps(key) + ':' + values
+        rval = item if rval is None else rval + item
+
+    return rval + '}'
+
+
+def to_copy_buffer(data, columns=None):
+    """ Write a DataFrame into an in-memory CSV buffer, which is ready
+    to be consumed by PostgreSQL `COPY ... FROM STDIN WITH CSV`.
+
+    Parameters
+    ----------
+    data: pandas.DataFrame.
+    columns: list of str or None.
+        The columns to write, in order. Default is all the columns.
+
+    Returns
+    -------
+    io.StringIO object, seeked to the start.
+    """
+    buffer = io.StringIO()
+    data.to_csv(buffer, columns=columns, header=False, index=False)
+    buffer.seek(0)
+    return buffer
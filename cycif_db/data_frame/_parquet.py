@@ -0,0 +1,105 @@
+""" Utils for writing cells data into Parquet datasets
+"""
+import logging
+import os
+
+from urllib.parse import quote
+
+
+log = logging.getLogger(__name__)
+
+# the same as Hive and pyarrow
+HIVE_NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def write_parquet_dataset(frames, root_path, partition_cols, dtypes=None):
+    """ Write DataFrame chunks into a Hive-partitioned Parquet dataset,
+    like `{root_path}/sample_name=xx/sample_tag=yy/part-0.parquet`.
+
+    Each partition is one file, kept open while the chunks stream in,
+    and each chunk becomes a row group of it, so only one chunk is held
+    in memory. The partition columns live in the directory names only.
+
+    Parameters
+    ----------
+    frames: iterable of pandas.DataFrame.
+        Chunks of the same columns.
+    root_path: str.
+        Directory of the dataset.
+    partition_cols: list of str.
+        Columns to partition by, in order.
+    dtypes: dict or None.
+        `column: type` of the data columns, type is one of ['int64',
+        'float32', 'float64', 'string']. Default is float64.
+
+    Returns
+    -------
+    The number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {
+        'int64': pa.int64(),
+        'float32': pa.float32(),
+        'float64': pa.float64(),
+        'string': pa.string(),
+    }
+    dtypes = dtypes or {}
+
+    writers = {}
+    schema = None
+    count = 0
+    try:
+        for df in frames:
+            if schema is None:
+                schema = pa.schema(
+                    [(col, types[dtypes.get(col, 'float64')])
+                     for col in df.columns if col not in partition_cols])
+
+            for key, group in df.groupby(list(partition_cols), sort=False,
+                                         dropna=False):
+                if not isinstance(key, tuple):
+                    key = (key,)
+                writer = writers.get(key)
+                if writer is None:
+                    writer = writers[key] = pq.ParquetWriter(
+                        _partition_file(root_path, partition_cols, key),
+                        schema)
+                writer.write_table(_to_arrow_table(group, schema))
+            count += df.shape[0]
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    log.info("Wrote %d rows into %d partitions of `%s`."
+             % (count, len(writers), root_path))
+    return count
+
+
+def _partition_file(root_path, partition_cols, key):
+    """ Make the directory of a partition and return the file path.
+    """
+    parts = []
+    for col, value in zip(partition_cols, key):
+        if value is None or value != value:
+            value = HIVE_NULL_PARTITION
+        parts.append('{}={}'.format(col, quote(str(value), safe='')))
+    folder = os.path.join(root_path, *parts)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, 'part-0.parquet')
+
+
+def _to_arrow_table(df, schema):
+    """ Convert a DataFrame to an arrow table in `schema`, casting the
+    object columns, e.g. Decimal and JSON values, column-wise.
+    """
+    import pyarrow as pa
+
+    arrays = []
+    for field in schema:
+        column = df[field.name]
+        if pa.types.is_floating(field.type):
+            column = column.astype(field.type.to_pandas_dtype())
+        arrays.append(pa.array(column, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,185 @@
+""" Mergeable summary statistics of feature values
+"""
+import math
+import numpy as np
+
+
+# relative accuracy of quantiles estimated by `Quantile_Sketch`
+SKETCH_ALPHA = 0.01
+
+# values closer to zero than this are counted as zeros
+MIN_SKETCH_VALUE = 1e-9
+
+
+class Quantile_Sketch(object):
+    """ A mergeable quantile sketch, in the way of DDSketch. Values are
+    counted in logarithmic buckets, so any quantile is estimated within
+    a relative error of `alpha`, and two sketches are merged by adding
+    up the bucket counts.
+
+    Parameters
+    -----------
+    alpha: float, default is 0.01.
+        Relative accuracy.
+    """
+    def __init__(self, alpha=SKETCH_ALPHA) -> None:
+        if not 0 < alpha < 1:
+            raise ValueError("Argument `alpha` must be between 0 and 1!")
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.zero = 0
+        self.pos = {}
+        self.neg = {}
+
+    @property
+    def count(self):
+        return self.zero + sum(self.pos.values()) + sum(self.neg.values())
+
+    def update(self, values):
+        """ Add values to the sketch. NaN is ignored.
+
+        Parameters
+        ----------
+        values: array-like of float.
+        """
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        absolute = np.abs(values)
+        nonzero = absolute > MIN_SKETCH_VALUE
+        self.zero += int((~nonzero).sum())
+        for store, mask in ((self.pos, values > 0), (self.neg, values < 0)):
+            mask &= nonzero
+            if not mask.any():
+                continue
+            keys = np.ceil(np.log(absolute[mask]) / self._log_gamma)
+            keys, counts = np.unique(keys.astype('int64'),
+                                     return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                store[key] = store.get(key, 0) + count
+
+    def merge(self, other):
+        """ Add up the buckets of another sketch of the same `alpha`.
+        """
+        if other.alpha != self.alpha:
+            raise ValueError("Can't merge sketches of different accuracy!")
+        self.zero += other.zero
+        for store, other_store in ((self.pos, other.pos),
+                                   (self.neg, other.neg)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+
+    def quantile(self, q):
+        """ Estimate the `q` quantile, 0 <= q <= 1. None if the sketch
+        is empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("Argument `q` must be between 0 and 1!")
+        count = self.count
+        if not count:
+            return None
+        rank = q * (count - 1)
+
+        seen = 0
+        for key in sorted(self.neg, reverse=True):
+            seen += self.neg[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.pos):
+            seen += self.pos[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return self._bucket_value(max(self.pos))
+
+    def _bucket_value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def to_dict(self):
+        """ Serialize into a JSON compatible dict.
+        """
+        return {
+            'alpha': self.alpha,
+            'zero': self.zero,
+            'pos': {str(k): v for k, v in self.pos.items()},
+            'neg': {str(k): v for k, v in self.neg.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        rval = cls(alpha=data['alpha'])
+        rval.zero = data.get('zero', 0)
+        rval.pos = {int(k): v for k, v in data.get('pos', {}).items()}
+        rval.neg = {int(k): v for k, v in data.get('neg', {}).items()}
+        return rval
+
+
+class Feature_Stats(object):
+    """ Running count, min, max, mean and M2, the sum of squared
+    differences from the mean, of a feature, together with a quantile
+    sketch. Stats of chunks are merged with the parallel algorithm of
+    Chan et al.
+
+    Parameters
+    -----------
+    alpha: float, default is 0.01.
+        Relative accuracy of the quantile sketch.
+    """
+    def __init__(self, alpha=SKETCH_ALPHA) -> None:
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = Quantile_Sketch(alpha=alpha)
+
+    @property
+    def variance(self):
+        """ Sample variance, None if count < 2.
+        """
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def update(self, values):
+        """ Add values. NaN is ignored.
+
+        Parameters
+        ----------
+        values: array-like of float.
+        """
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+        other = Feature_Stats(alpha=self.sketch.alpha)
+        other.count = int(values.size)
+        other.min = float(values.min())
+        other.max = float(values.max())
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.sketch.update(values)
+        self.merge(other)
+
+    def merge(self, other):
+        """ Merge the stats of another set of values.
+        """
+        self.sketch.merge(other.sketch)
+        if not other.count:
+            return
+        if not self.count:
+            self.count, self.min, self.max = other.count, other.min, other.max
+            self.mean, self.m2 = other.mean, other.m2
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
@@ -0,0 +1,2 @@
+from ._batch import (add_samples_from_dir, find_sample_complex,
+                     summarize_results)
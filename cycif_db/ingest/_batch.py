@@ -0,0 +1,143 @@
+""" Batch ingestion of sample complexes in parallel processes.
+"""
+import json
+import logging
+import pathlib
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from ..cyc_session import CycSession
+from ..utils import engine_maker
+
+
+log = logging.getLogger(__name__)
+
+
+def find_sample_complex(folder):
+    """ Locate the cells quantification, markers and annotation files
+    in a sample folder. The folder name is used as sample name and tag,
+    separated by `__`.
+
+    Parameters
+    ----------
+    folder: str or pathlib.Path.
+
+    Returns
+    -------
+    Tuple, (sample, cells_path, markers_path). `sample` is a dict.
+    """
+    folder = pathlib.Path(folder)
+
+    cells_path, markers_path, sample_annotation = '', '', ''
+    for fl in folder.iterdir():
+        fl_name = fl.name.lower()
+        if 'quantification' in fl_name or '_quant.csv' in fl_name:
+            cells_path = str(fl.absolute())
+        elif 'markers.csv' in fl_name:
+            markers_path = str(fl.absolute())
+        elif fl.stem == 'annotation':
+            with open(fl.absolute(), 'r') as fp:
+                sample_annotation = fp.read()
+
+    if not cells_path:
+        raise Exception("Couldn't find a file having `quantification` in "
+                        "name!")
+    if not markers_path:
+        raise Exception("Couldn't find a file having `markers.csv` in "
+                        "name!")
+
+    sample_args = folder.name.split('__', 1)
+    sample = dict(name=sample_args[0].strip())
+    if len(sample_args) > 1:
+        sample['tag'] = sample_args[1].strip()
+    if sample_annotation.strip():
+        sample['annotation'] = json.loads(sample_annotation.strip())
+
+    return sample, cells_path, markers_path
+
+
+def _add_sample_folder(folder, url=None, **kwargs):
+    """ Worker to ingest a single sample folder, with its own engine and
+    session. Never raises, the error is returned in the result instead.
+    """
+    result = {'folder': str(folder), 'sample': None, 'success': False,
+              'error': None, 'elapsed': 0.}
+    start_time = time.time()
+    engine = None
+    try:
+        sample, cells_path, markers_path = find_sample_complex(folder)
+        result['sample'] = sample
+        engine = engine_maker(url)
+        with CycSession(bind=engine) as csess:
+            csess.add_sample_complex(sample, cells_path, markers_path,
+                                     **kwargs)
+        result['success'] = True
+    except Exception as e:
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+        log.error("Failed to add sample folder `%s`: %s"
+                  % (folder, result['error']))
+    finally:
+        if engine is not None:
+            engine.dispose()
+    result['elapsed'] = time.time() - start_time
+
+    return result
+
+
+def add_samples_from_dir(parent, workers=4, url=None, **kwargs):
+    """ Ingest all sample folders under a parent directory, in parallel
+    processes. Each sample is added and committed independently, so a
+    failed sample doesn't affect the others.
+
+    Parameters
+    ----------
+    parent: str or pathlib.Path.
+        The folder containing sample folders.
+    workers: int, default is 4.
+        The maximum number of worker processes.
+    url: str or None.
+        Database URL. Default is the `db_url` in `config.yml`.
+    kwargs: keywords parameter.
+        Used in `CycSession.add_sample_complex`, like `dry_run`, `loader`
+        and `chunksize`.
+
+    Returns
+    -------
+    List of dicts, one result per sample folder, in the order of folder
+    names.
+    """
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError("Argument `workers` must be a positive integer!")
+
+    parent = pathlib.Path(parent)
+    folders = sorted(x for x in parent.iterdir() if x.is_dir())
+    log.info("Found %d sample folders in `%s`." % (len(folders), parent))
+    if not folders:
+        return []
+
+    workers = min(workers, len(folders))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_add_sample_folder, folder, url=url,
+                                   **kwargs)
+                   for folder in folders]
+        results = [future.result() for future in futures]
+
+    log.info(summarize_results(results))
+    return results
+
+
+def summarize_results(results):
+    """ Make a printable report from the results of `add_samples_from_dir`.
+    """
+    n_success = sum(1 for rval in results if rval['success'])
+    lines = ["Added %d of %d samples, %d failed."
+             % (n_success, len(results), len(results) - n_success)]
+    for rval in results:
+        status = 'OK' if rval['success'] else 'FAILED'
+        line = "%-6s %s (%.1f s)" % (status, rval['folder'], rval['elapsed'])
+        if rval['error']:
+            line += ": " + rval['error']
+        lines.append(line)
+
+    return '\n'.join(lines)
@@ -22,6 +22,31 @@ class Marker_Comparator:
             raise ValueError("Invalid input for argument `keep_duplicates`!")
         self.keep_duplicates = keep_duplicates
 
+        # The keys are computed once, so the marker is supposed to be
+        # unchanged during the lifetime of the comparator.
+        self._flags = (fluor_sensitive, anti_sensitive)
+        self._eq_key = self._make_eq_key(self.marker)
+        self._sort_key = repr(self).lower()
+        self._hash = hash(self._make_hash_key())
+
+    def _make_eq_key(self, marker):
+        """ The identity of a marker under the sensitivity flags of
+        this comparator.
+        """
+        return (marker.name.lower(),
+                (marker.fluor or '').lower() if self.fluor_sensitive
+                else None,
+                (marker.anti or '').lower() if self.anti_sensitive
+                else None)
+
+    def _make_hash_key(self):
+        key = self.marker.name.lower()
+        if self.fluor_sensitive and self.marker.fluor:
+            key += self.marker.fluor.lower()
+        if self.anti_sensitive and self.marker.anti:
+            key += self.marker.anti.lower()
+        return key
+
     def __repr__(self) -> str:
         rval = self.marker.name
         if self.fluor_sensitive and self.marker.fluor:
@@ -37,28 +62,12 @@ class Marker_Comparator:
         if not isinstance(other, Marker_Comparator):
             return False
 
-        rval = (self.marker.name.lower() == other.marker.name.lower())
-        if self.fluor_sensitive:
-            this_fluor = self.marker.fluor or ''
-            other_fluor = other.marker.fluor or ''
-            rval = rval and \
-                (this_fluor.lower() == other_fluor.lower())
-        if self.anti_sensitive:
-            this_anti = self.marker.anti or ''
-            other_anti = other.marker.anti or ''
-            rval = rval and \
-                (this_anti.lower() == other_anti.lower())
-
-        return rval
+        if self._flags == other._flags:
+            return self._eq_key == other._eq_key
+        return self._eq_key == self._make_eq_key(other.marker)
 
     def __lt__(self, other) -> bool:
-        return repr(self).lower() < repr(other).lower()
+        return self._sort_key < other._sort_key
 
     def __hash__(self) -> int:
-        key = self.marker.name.lower()
-        if self.fluor_sensitive and self.marker.fluor:
-            key += self.marker.fluor.lower()
-        if self.anti_sensitive and self.marker.anti:
-            key += self.marker.anti.lower()
-
-        return hash(key)
+        return self._hash
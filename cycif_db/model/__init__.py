@@ -1,3 +1,5 @@
 from .mapping import (
-    Cell, Sample, Marker, Marker_Alias, Sample_Marker_Association)
+    Cell, Sample, Marker, Marker_Alias, Sample_Marker_Association,
+    Sample_Feature, Sample_Feature_Stats, cell_centroid, cell_partition,
+    cell_partition_name)
 from .check import create_db
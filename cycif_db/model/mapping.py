@@ -4,12 +4,13 @@ Data model classes
 """
 import logging
 
-from sqlalchemy import Column, ForeignKey, func, Index
+from sqlalchemy import Column, column, ForeignKey, func, Index, table
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import (
     DateTime,
+    Float,
     Integer,
     Numeric,
     String,
@@ -38,6 +39,11 @@ Base = declarative_base()
 
 
 class Sample(Base):
+    """ Each sample owns a `cell` partition, see `Cell`. Add and remove
+    samples by `CycSession.add_sample` and `CycSession.delete_sample`,
+    which create and drop the partition; deleting rows of `sample`
+    directly leaves the partition and its cells behind.
+    """
     __tablename__ = 'sample'
 
     id = Column(Integer, autoincrement=True, primary_key=True)
@@ -46,12 +52,18 @@ class Sample(Base):
     annotation = Column(JSONB)
     entry_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    cells = relationship('Cell', back_populates='sample')
+    cells = relationship('Cell', back_populates='sample',
+                         primaryjoin='Sample.id == foreign(Cell.sample_id)')
     markers = relationship('Marker',
                            secondary='sample_marker_association',
                            back_populates='samples')
     marker_associates = relationship('Sample_Marker_Association',
                                      back_populates='sample')
+    feature_manifest = relationship('Sample_Feature',
+                                    back_populates='sample',
+                                    order_by='Sample_Feature.position')
+    feature_stats = relationship('Sample_Feature_Stats',
+                                 back_populates='sample')
 
     def __repr__(self):
         return "<Sample({}: '{}', '{}')>".format(
@@ -138,17 +150,86 @@ Index('ix_sample_marker_associate',
       Sample_Marker_Association.channel_number, unique=True)
 
 
+class Sample_Feature(Base):
+    """ Manifest of the marker features, i.e. the keys of
+    `Cell.features`, of a sample, in the order of ingestion.
+    """
+    __tablename__ = 'sample_feature'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    sample_id = Column(Integer, ForeignKey("sample.id", ondelete="CASCADE",
+                                           onupdate="CASCADE"),
+                       nullable=False)
+    position = Column(Integer, nullable=False)
+    db_key = Column(String, nullable=False)
+    marker_id = Column(Integer, ForeignKey("marker.id", onupdate="CASCADE"),
+                       nullable=False)
+    mask_type = Column(String, nullable=False)
+
+    sample = relationship("Sample", back_populates="feature_manifest")
+    marker = relationship("Marker")
+
+    def __repr__(self):
+        return "<Sample_Feature(sample_id={}, db_key='{}')>"\
+            .format(self.sample_id, self.db_key)
+
+
+Index('ix_sample_feature', Sample_Feature.sample_id, Sample_Feature.position,
+      unique=True)
+
+
+class Sample_Feature_Stats(Base):
+    """ Summary statistics of a marker feature of a sample, computed
+    at ingestion. `m2` is the sum of squared differences from the mean
+    and `sketch` is a serialized `Quantile_Sketch`.
+    """
+    __tablename__ = 'sample_feature_stats'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    sample_id = Column(Integer, ForeignKey("sample.id", ondelete="CASCADE",
+                                           onupdate="CASCADE"),
+                       nullable=False)
+    db_key = Column(String, nullable=False)
+    count = Column(Integer, nullable=False)
+    min = Column(Float)
+    max = Column(Float)
+    mean = Column(Float)
+    m2 = Column(Float)
+    sketch = Column(JSONB)
+
+    sample = relationship("Sample", back_populates="feature_stats")
+
+    def __repr__(self):
+        return "<Sample_Feature_Stats(sample_id={}, db_key='{}')>"\
+            .format(self.sample_id, self.db_key)
+
+
+Index('ix_sample_feature_stats', Sample_Feature_Stats.sample_id,
+      Sample_Feature_Stats.db_key, unique=True)
+
+
 class Cell(Base):
+    """ Cells are LIST partitioned by `sample_id`, one partition per
+    sample, see `cell_partition_name`.
+
+    There is no foreign key to `sample` and no ON DELETE CASCADE, so the
+    partitions are managed by `CycSession` only: `add_sample` and
+    `insert_cells_mappings` create the partition, `delete_sample` and
+    `delete_all` drop it. Cells inserted into `cell` without the
+    partition fail with "no partition of relation", and cells of a
+    sample deleted in raw SQL are orphaned.
+    """
     __tablename__ = 'cell'
+    __table_args__ = {'postgresql_partition_by': 'LIST (sample_id)'}
 
     id = Column(Integer, autoincrement=True, primary_key=True)
-    sample_id = Column(Integer, ForeignKey("sample.id", ondelete="CASCADE"),
-                       onupdate='CASCADE', nullable=False)
+    sample_id = Column(Integer, primary_key=True, nullable=False)
     sample_cell_id = Column(Integer)     # local experiment ID
     entry_at = Column(DateTime(timezone=True), server_default=func.now())
     features = Column(JSONB)
 
-    sample = relationship("Sample", back_populates="cells")
+    sample = relationship("Sample", back_populates="cells",
+                          primaryjoin='Sample.id == foreign(Cell.sample_id)')
 
     def __repr__(self):
         return "<Cell(sample={}, sample_cell_id={})>"\
@@ -162,5 +243,34 @@ for ftr in OTHER_FEATHERS:
     setattr(Cell, ftr, Column(Numeric(15, 4)))
 
 
+# backs per-sample export ordered by `sample_cell_id`
+Index('ix_cell_sample_cell_id', Cell.sample_id, Cell.sample_cell_id)
+
+# backs region queries on centroids, see `cell_centroid`
+Index('ix_cell_centroid', func.point(Cell.x_centroid, Cell.y_centroid),
+      postgresql_using='gist')
+
+
+def cell_centroid():
+    """ The centroid of cells as a geometric point, the same
+    expression as `ix_cell_centroid` is on.
+    """
+    return func.point(Cell.x_centroid, Cell.y_centroid)
+
+
+def cell_partition_name(sample_id):
+    """ Name of the `cell` partition holding cells of a sample.
+    """
+    return 'cell_sample_%d' % int(sample_id)
+
+
+def cell_partition(sample_id):
+    """ Lightweight table construct of a `cell` partition, used to
+    write cells into the partition directly.
+    """
+    return table(cell_partition_name(sample_id),
+                 *[column(c.name, c.type) for c in Cell.__table__.columns])
+
+
 def init(engine):
     Base.metadata.create_all(engine)
@@ -0,0 +1 @@
+from ._filter import parse_filter
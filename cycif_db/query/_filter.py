@@ -0,0 +1,132 @@
+""" Parser of gating filters on cells, like
+`CD3__cell_masks > 500 & area < 200`.
+"""
+import re
+
+
+COMPARATORS = ('<=', '>=', '==', '!=', '<', '>')
+
+# flip the operator when the number is on the left, `500 < x` => `x > 500`
+FLIPPED = {'<': '>', '>': '<', '<=': '>=', '>=': '<=', '==': '==',
+           '!=': '!='}
+
+KEYWORDS = {'and': '&', 'or': '|', 'not': '~'}
+
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<name>[A-Za-z_][\w.\-]*)
+      | `(?P<quoted>[^`]+)`
+      | (?P<op><=|>=|==|!=|<|>|&|\||~|\(|\))
+    )""", re.VERBOSE)
+
+
+def parse_filter(expr):
+    """ Parse a filter expression into a tree of tuples.
+
+    A comparison is between a feature and a number, in one of
+    `<, <=, >, >=, ==, !=`. Comparisons are combined by `&` (`and`),
+    `|` (`or`) and `~` (`not`), and grouped by parentheses. `~` binds
+    tightest and `|` loosest. Features starting with a digit or having
+    whitespaces are quoted by backticks, e.g. `` `14-3-3__cl` > 1 ``.
+
+    Parameters
+    ----------
+    expr: str.
+
+    Returns
+    -------
+    Tuple, one of `('cmp', op, name, value)`, `('not', node)`,
+    `('and', left, right)` and `('or', left, right)`.
+    """
+    parser = _Parser(_tokenize(expr), expr)
+    rval = parser.parse_or()
+    if parser.peek() is not None:
+        parser.error("Unexpected `%s`" % parser.peek()[1])
+    return rval
+
+
+def _tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        match = TOKEN_RE.match(expr, pos)
+        if not match:
+            raise ValueError("Invalid filter `%s`: unrecognized character "
+                             "at %d!" % (expr, pos))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'quoted':
+            kind = 'name'
+        elif kind == 'name' and value.lower() in KEYWORDS:
+            kind, value = 'op', KEYWORDS[value.lower()]
+        elif kind == 'number':
+            value = float(value)
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _Parser(object):
+    """ Recursive descent parser over tokens.
+    """
+    def __init__(self, tokens, expr):
+        self.tokens = tokens
+        self.expr = expr
+        self.pos = 0
+
+    def error(self, msg):
+        raise ValueError("Invalid filter `%s`: %s!" % (self.expr, msg))
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            self.error("Unexpected end")
+        self.pos += 1
+        return token
+
+    def accept(self, op):
+        if self.peek() == ('op', op):
+            self.pos += 1
+            return True
+        return False
+
+    def parse_or(self):
+        rval = self.parse_and()
+        while self.accept('|'):
+            rval = ('or', rval, self.parse_and())
+        return rval
+
+    def parse_and(self):
+        rval = self.parse_not()
+        while self.accept('&'):
+            rval = ('and', rval, self.parse_not())
+        return rval
+
+    def parse_not(self):
+        if self.accept('~'):
+            return ('not', self.parse_not())
+        if self.accept('('):
+            rval = self.parse_or()
+            if not self.accept(')'):
+                self.error("Missing `)`")
+            return rval
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.next()
+        op = self.next()
+        right = self.next()
+        if op[0] != 'op' or op[1] not in COMPARATORS:
+            self.error("Expected a comparison, but got `%s`" % op[1])
+        if left[0] == 'name' and right[0] == 'number':
+            return ('cmp', op[1], left[1], right[1])
+        if left[0] == 'number' and right[0] == 'name':
+            return ('cmp', FLIPPED[op[1]], right[1], left[1])
+        self.error("A comparison must be between a feature and a number, "
+                   "but got `%s %s %s`" % (left[1], op[1], right[1]))
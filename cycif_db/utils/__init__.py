@@ -1 +1,2 @@
 from ._general import engine_maker, get_configs, session_maker
+from ._pipeline import run_pipeline
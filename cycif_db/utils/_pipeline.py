@@ -0,0 +1,112 @@
+""" Utils to overlap reading, transforming and writing data in chunks
+"""
+import queue
+import threading
+
+
+# seconds to wait before checking whether the pipeline was stopped
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class _Failure(object):
+    """ Wrapper of an exception raised in an upstream stage.
+    """
+    def __init__(self, error):
+        self.error = error
+
+
+def run_pipeline(source, transform, consume, queue_depth=2):
+    """ Run a three-stage pipeline. `source` is iterated in a reader
+    thread, each item is passed to `transform` in another thread, and the
+    results are passed to `consume` in the calling thread, in order. The
+    stages are connected by bounded queues, so at most `queue_depth`
+    items are waiting between two stages.
+
+    An exception raised in any stage stops the pipeline and is re-raised
+    in the calling thread.
+
+    Parameters
+    ----------
+    source: iterable.
+    transform: callable.
+    consume: callable.
+    queue_depth: int, default is 2.
+        The maximum size of the queues between stages.
+
+    Returns
+    -------
+    List of the return values of `consume`.
+    """
+    if not isinstance(queue_depth, int) or queue_depth < 1:
+        raise ValueError("Argument `queue_depth` must be a positive "
+                         "integer!")
+
+    stop = threading.Event()
+    read_queue = queue.Queue(maxsize=queue_depth)
+    transform_queue = queue.Queue(maxsize=queue_depth)
+
+    threads = [
+        threading.Thread(target=_run_stage,
+                         args=(lambda: iter(source), lambda x: x,
+                               read_queue, stop),
+                         name='pipeline-reader', daemon=True),
+        threading.Thread(target=_run_stage,
+                         args=(lambda: _drain(read_queue, stop), transform,
+                               transform_queue, stop),
+                         name='pipeline-transformer', daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    rval = []
+    try:
+        for item in _drain(transform_queue, stop):
+            rval.append(consume(item))
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    return rval
+
+
+def _run_stage(get_items, func, out_queue, stop):
+    """ Apply `func` to items and put the results into `out_queue`, ending
+    with `_DONE`, or a `_Failure` if anything goes wrong.
+    """
+    try:
+        for item in get_items():
+            if not _put(out_queue, func(item), stop):
+                return
+        _put(out_queue, _DONE, stop)
+    except BaseException as e:
+        _put(out_queue, _Failure(e), stop)
+
+
+def _put(out_queue, item, stop):
+    """ Put an item into a queue, unless the pipeline was stopped.
+    """
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(in_queue, stop):
+    """ Yield items from a queue until `_DONE`. Re-raise upstream errors.
+    """
+    while not stop.is_set():
+        try:
+            item = in_queue.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
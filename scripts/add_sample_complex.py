@@ -4,12 +4,12 @@ Help:
 python scripts/add_sample_complex.py --help
 """
 import argparse
-import json
 import logging
 import pathlib
 import time
 
 from cycif_db import CycSession
+from cycif_db.ingest import find_sample_complex
 
 
 log = logging.getLogger(__name__)
@@ -35,6 +35,16 @@ parser.add_argument(
     help=("If enabled, run the add_sample_complex script without "
           "committing. Database will not be changed, as a result.")
 )
+parser.add_argument(
+    '--loader', default='orm', choices=['orm', 'copy'],
+    help=("How cells are inserted. `copy` streams cells into database "
+          "with PostgreSQL `COPY`, which is faster for large datasets.")
+)
+parser.add_argument(
+    '--pipelined', default=False, action='store_true',
+    help=("If enabled, read and transform the next chunks of cells while "
+          "the current chunk is being inserted into database.")
+)
 parser.add_argument(
     '-v', '--verbose', default=False, action='store_true',
     help="Show detailed log.")
@@ -45,31 +55,10 @@ if args.verbose:
     logging.basicConfig(level=logging.DEBUG)
 
 folder = args.dir
-sample_annotation = ''
 
 if folder:
-    folder = pathlib.Path(folder)
-    log.info("Use folder: %s", str(folder))
-
-    sample_args = folder.name
-
-    cells_path, markers_path = '', ''
-    for fl in folder.iterdir():
-        fl_name = fl.name.lower()
-        if 'quantification' in fl_name or '_quant.csv' in fl_name:
-            cells_path = str(fl.absolute())
-        elif 'markers.csv' in fl_name:
-            markers_path = str(fl.absolute())
-        elif fl.stem == 'annotation':
-            with open(fl.absolute(), 'r') as fp:
-                sample_annotation = fp.read()
-
-    if not cells_path:
-        raise Exception("Couldn't find a file having `quantification` in "
-                        "name!")
-    if not markers_path:
-        raise Exception("Couldn't find a file having `markers.csv` in "
-                        "name!")
+    log.info("Use folder: %s", folder)
+    sample, cells_path, markers_path = find_sample_complex(folder)
 else:
     if not args.sample:
         raise Exception("Positional argument `sample` was required or "
@@ -84,12 +73,10 @@ else:
         raise Exception("Positional argument `markers` was required!")
     markers_path = str(pathlib.Path(args.markers).absolute())
 
-sample_args = sample_args.split('__', 1)
-sample = dict(name=sample_args[0].strip())
-if len(sample_args) > 1:
-    sample['tag'] = sample_args[1].strip()
-if sample_annotation:
-    sample['annotation'] = json.loads(sample_annotation.strip())
+    sample_args = sample_args.split('__', 1)
+    sample = dict(name=sample_args[0].strip())
+    if len(sample_args) > 1:
+        sample['tag'] = sample_args[1].strip()
 
 log.info("The sample info: {}.".format(sample))
 log.info(f"The path to Cells: {cells_path}.")
@@ -98,6 +85,7 @@ log.info(f"The path to Markers: {markers_path}.")
 start_time = time.time()
 with CycSession() as csess:
     csess.add_sample_complex(
-        sample, cells_path, markers_path, dry_run=args.dry_run)
+        sample, cells_path, markers_path, dry_run=args.dry_run,
+        loader=args.loader, pipelined=args.pipelined)
 end_time = time.time()
 log.info("Finished in %.10f s" % (end_time - start_time))
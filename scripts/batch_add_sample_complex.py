@@ -0,0 +1,56 @@
+""" Ingest all sample folders under a parent directory into database,
+in parallel processes.
+
+Help:
+python scripts/batch_add_sample_complex.py --help
+"""
+import argparse
+import logging
+import time
+
+from cycif_db.ingest import add_samples_from_dir, summarize_results
+
+
+log = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    'parent', type=str,
+    help=("The folder containing sample folders. Each sample folder has "
+          "both cells and markers csv, and its name is used as sample name "
+          "and tag, separated by `__`."))
+parser.add_argument(
+    '--workers', '-w', type=int, default=4,
+    help="The maximum number of worker processes.")
+parser.add_argument(
+    '--dry_run', default=False, action='store_true',
+    help=("If enabled, run the add_sample_complex script without "
+          "committing. Database will not be changed, as a result.")
+)
+parser.add_argument(
+    '--loader', default='orm', choices=['orm', 'copy'],
+    help=("How cells are inserted. `copy` streams cells into database "
+          "with PostgreSQL `COPY`, which is faster for large datasets.")
+)
+parser.add_argument(
+    '--pipelined', default=False, action='store_true',
+    help=("If enabled, read and transform the next chunks of cells while "
+          "the current chunk is being inserted into database.")
+)
+parser.add_argument(
+    '-v', '--verbose', default=False, action='store_true',
+    help="Show detailed log.")
+
+args = parser.parse_args()
+
+if args.verbose:
+    logging.basicConfig(level=logging.DEBUG)
+
+start_time = time.time()
+results = add_samples_from_dir(args.parent, workers=args.workers,
+                               dry_run=args.dry_run, loader=args.loader,
+                               pipelined=args.pipelined)
+end_time = time.time()
+
+print(summarize_results(results))
+log.info("Finished in %.10f s" % (end_time - start_time))
@@ -0,0 +1,80 @@
+""" Micro-benchmark of serializing a chunk of marker intensities into
+JSONB text, comparing the per-row dict path with `encode_features`, in
+time, peak memory and the size of the JSON text sent to database.
+
+Help:
+python scripts/benchmark_encode_features.py --help
+"""
+import argparse
+import json
+import numpy as np
+import pandas as pd
+import time
+import tracemalloc
+
+from cycif_db.data_frame import encode_features
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '--rows', '-r', type=int, default=10000,
+    help="The number of cells in a chunk.")
+parser.add_argument(
+    '--markers', '-m', type=int, default=80,
+    help="The number of marker columns.")
+parser.add_argument(
+    '--decimals', '-d', type=int, default=4,
+    help="Number of decimal places to round to.")
+parser.add_argument(
+    '--repeat', '-n', type=int, default=5,
+    help="Run each encoder multiple times and report the best.")
+
+args = parser.parse_args()
+
+
+def encode_by_records(data, keys, decimals):
+    """ The per-row dict path, as `bulk_insert_mappings` serializes
+    the `features` column.
+    """
+    df = data.round(decimals=decimals)
+    df.columns = keys
+    return [json.dumps(x) for x in df.to_dict('records')]
+
+
+def measure(func, data, keys, decimals, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func(data, keys, decimals)
+        timings.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    rval = func(data, keys, decimals)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    payload = sum(len(x) for x in rval)
+    return min(timings), peak, payload
+
+
+rng = np.random.default_rng(0)
+data = pd.DataFrame(rng.random((args.rows, args.markers)) * 20000)
+keys = ['%d_cl' % i for i in range(args.markers)]
+
+baseline = encode_by_records(data, keys, args.decimals)
+encoded = encode_features(data, keys=keys, decimals=args.decimals)
+assert [json.loads(x) for x in baseline] == \
+    [json.loads(x) for x in encoded], "The encoders were not equivalent!"
+
+print("%d rows x %d markers, decimals=%d"
+      % (args.rows, args.markers, args.decimals))
+print("%-20s %12s %14s %13s" % ('encoder', 'best time (s)', 'peak mem (MB)',
+                                'payload (MB)'))
+for name, func in [
+        ('to_dict records', encode_by_records),
+        ('encode_features',
+         lambda x, k, d: encode_features(x, keys=k, decimals=d))]:
+    elapsed, peak, payload = measure(func, data, keys, args.decimals,
+                                     args.repeat)
+    print("%-20s %12.4f %14.1f %13.1f"
+          % (name, elapsed, peak / 2 ** 20, payload / 2 ** 20))
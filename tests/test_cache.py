@@ -0,0 +1,124 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import tempfile
+
+from datetime import datetime, timezone
+
+from nose.tools import assert_raises
+from cycif_db.cache import Cells_Cache, Matrix_Cache
+from cycif_db.cache._matrix_cache import MANIFEST_FILE
+
+
+def _frame(n, seed=0):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'sample_name': ['s%d' % seed] * n,
+        'sample_cell_id': np.arange(1, n + 1, dtype='int64'),
+        'cd45__cell_masks': rng.rand(n).astype('float32'),
+        'area': rng.rand(n),
+    })
+
+
+def test_cells_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = Cells_Cache(tmp)
+        key = Cells_Cache.make_key({'samples': [1, 2], 'markers': None})
+        assert key == Cells_Cache.make_key({'markers': None,
+                                            'samples': [1, 2]})
+        assert cache.get(key) is None
+
+        df = _frame(100)
+        cache.put(key, df, [1, 2])
+        assert key in cache and len(cache) == 1
+        pd.testing.assert_frame_equal(cache.get(key), df)
+
+        # the index persists
+        cache = Cells_Cache(tmp)
+        pd.testing.assert_frame_equal(cache.get(key), df)
+
+        other = Cells_Cache.make_key({'samples': [3]})
+        cache.put(other, _frame(10, seed=3), [3])
+        assert cache.invalidate([2]) == 1
+        assert key not in cache and other in cache
+        assert len(os.listdir(tmp)) == 2, os.listdir(tmp)
+
+        # a corrupt file is a miss and removed
+        with open(os.path.join(tmp, cache._entries[other]['file']),
+                  'wb') as fp:
+            fp.write(b'PAR1 broken')
+        assert cache.get(other) is None
+        assert other not in cache
+        cache.put(other, _frame(10, seed=3), [3])
+
+        cache.clear()
+        assert len(cache) == 0 and cache.size == 0
+
+    assert_raises(ValueError, Cells_Cache, tmp, max_bytes=0)
+
+
+def test_cells_cache_eviction():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = Cells_Cache(tmp)
+        cache.put('a', _frame(1000, seed=1), [1])
+        size = cache.size
+        cache = Cells_Cache(tmp, max_bytes=int(size * 2.5))
+        cache.put('b', _frame(1000, seed=2), [2])
+        # `a` becomes the most recently used
+        cache.get('a')
+        cache.put('c', _frame(1000, seed=3), [3])
+        assert 'a' in cache and 'c' in cache and 'b' not in cache
+        assert cache.size <= cache.max_bytes
+
+        # larger than the whole cache
+        cache.put('d', _frame(10000, seed=4), [4])
+        assert 'd' not in cache and len(cache) == 2
+
+
+def test_matrix_cache():
+    entry_at = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    db_keys = ['cd45__cell_masks']
+    df = _frame(100).drop(columns='sample_name')
+    df['cd45__cell_masks'] = df['cd45__cell_masks'].astype('float64')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = Matrix_Cache(tmp)
+        assert cache.load(1, entry_at, db_keys) is None
+        cache.save(1, entry_at, db_keys, df)
+        rval = cache.load(1, entry_at, db_keys)
+        assert (rval.dtypes == ['int64', 'float32', 'float32']).all()
+        pd.testing.assert_frame_equal(rval, df, check_dtype=False)
+        assert not rval['area'].to_numpy().flags.writeable
+
+        # stale entries
+        assert cache.load(1, datetime.now(timezone.utc), db_keys) is None
+        assert cache.load(1, entry_at, db_keys + ['cd3__cell_masks']) \
+            is None
+
+        # saving again replaces the old version
+        cache.save(1, entry_at, db_keys, df[:10])
+        assert cache.load(1, entry_at, db_keys).shape == (10, 3)
+        assert len(os.listdir(os.path.join(tmp, 'sample_1'))) == 3
+
+        # files of a concurrent writer are kept, and files of the
+        # replaced version already removed don't fail the save
+        folder = os.path.join(tmp, 'sample_1')
+        with open(os.path.join(folder, MANIFEST_FILE)) as fp:
+            manifest = json.load(fp)
+        other = os.path.join(folder, 'other-features.npy')
+        np.save(other, np.zeros(1))
+        os.remove(os.path.join(folder, manifest['matrix']))
+        cache.save(1, entry_at, db_keys, df)
+        assert os.path.exists(other)
+        assert not os.path.exists(os.path.join(folder, manifest['ids']))
+        pd.testing.assert_frame_equal(cache.load(1, entry_at, db_keys), df,
+                                      check_dtype=False)
+        os.remove(other)
+
+        cache.invalidate([1])
+        assert cache.load(1, entry_at, db_keys) is None
+
+        df['sample_cell_id'] = df['sample_cell_id'].where(df.index > 0)
+        assert not cache.save(2, entry_at, db_keys, df)
+        assert cache.load(2, entry_at, db_keys) is None
@@ -1,13 +1,19 @@
+import os
 import pandas as pd
 import pathlib
 import random
 import string
+import tempfile
+
+from io import StringIO
 
 from nose.tools import assert_raises
+from sqlalchemy import func, text
 from sqlalchemy_utils import drop_database, database_exists
 from cycif_db import CycSession
+from cycif_db.cache import Cells_Cache, Matrix_Cache
 from cycif_db.cyc_session import DB_Key, fuse_db_keys
-from cycif_db.model import create_db, Sample, Cell, Marker
+from cycif_db.model import create_db, Sample, Cell, Marker, Marker_Alias
 from cycif_db.utils import engine_maker
 
 
@@ -228,3 +234,676 @@ def test_fuse_db_keys():
 
     fused = fuse_db_keys(csess, [keys_76, keys_84], marker_filter='union')
     assert len(fused) == 56, fused
+
+
+def test_add_sample_complex_copy():
+    cells = pd.DataFrame({
+        "CellID": [1, 2, 3],
+        "Area": [120, 98, 143],
+        "X_centroid": [10.123456, 20.5, 30.25],
+        "CD45_1_Cell Masks": [15809.175000, 1.5, None],
+        "DAPI_1_Nuclei Masks": [17131.137500, 2.25, 3.0]
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1, 2],
+        "cycle_number": [1, 1],
+        "marker_name": ['DAPI', 'CD45']
+    })
+
+    csess.add_sample_complex({'name': 'copy_sample', 'tag': 'v1'},
+                             cells, markers, loader='copy', dry_run=True)
+    assert csess.get_sample(name='copy_sample', tag='v1') is None
+
+    csess.add_sample_complex({'name': 'copy_sample', 'tag': 'v1'},
+                             cells, markers, chunksize=2, loader='copy')
+    sample = csess.get_sample(name='copy_sample', tag='v1')
+    rval = csess.query(Cell) \
+        .filter(Cell.sample_id == sample.id) \
+        .order_by(Cell.sample_cell_id).all()
+    assert len(rval) == 3, rval
+
+    cd45 = csess.marker_header_to_dbkey('CD45_1_Cell Masks')
+    dapi = csess.marker_header_to_dbkey('DAPI_1_Nuclei Masks')
+    assert float(rval[0].x_centroid) == 10.1235, rval[0].x_centroid
+    assert rval[0].features == {cd45: 15809.175, dapi: 17131.1375}, \
+        rval[0].features
+    assert rval[2].features == {cd45: None, dapi: 3.0}, rval[2].features
+
+    assert_raises(ValueError, csess.insert_cells_mappings,
+                  sample.id, cells, loader='unknown')
+
+
+def test_get_alias_map():
+    csess.clear_alias_map()
+    alias_map = csess.get_alias_map()
+    assert alias_map is csess.get_alias_map()
+    assert alias_map['cd45'] == csess.get_alias_marker_id('CD 45'), alias_map
+    assert csess.get_alias_marker_id('Something_New') is None
+
+    csess.insert_or_sync_markers()
+    assert csess._alias_map is None
+    assert csess.get_alias_map() == alias_map
+
+
+def test_insert_or_sync_markers():
+    rval = csess.insert_or_sync_markers()
+    assert rval == {'markers_inserted': [], 'aliases_inserted': [],
+                    'aliases_repointed': []}, rval
+
+    cd45 = csess.get_alias_marker_id('CD45')
+    alias = csess.query(Marker_Alias) \
+        .filter(func.lower(Marker_Alias.name) == 'cd45').one()
+    alias.marker_id = csess.get_alias_marker_id('DAPI')
+    csess.commit()
+
+    rval = csess.insert_or_sync_markers()
+    assert rval['markers_inserted'] == [], rval
+    assert rval['aliases_inserted'] == [], rval
+    assert rval['aliases_repointed'] == \
+        [('CD45', csess.get_alias_marker_id('DAPI'), cd45)], rval
+    assert csess.get_alias_marker_id('CD45') == cd45
+
+
+def test_add_sample_complex_pipelined():
+    cells = pd.DataFrame({
+        "CellID": list(range(1, 11)),
+        "Area": [100.5] * 10,
+        "CD45_1_Cell Masks": [float(x) for x in range(10)],
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1],
+        "cycle_number": [1],
+        "marker_name": ['CD45']
+    })
+
+    for loader in ('orm', 'copy'):
+        csess.add_sample_complex({'name': 'pipelined_sample', 'tag': loader},
+                                 cells, markers, chunksize=3, loader=loader,
+                                 pipelined=True, queue_depth=1)
+        sample = csess.get_sample(name='pipelined_sample', tag=loader)
+        n_cells = csess.query(Cell.id) \
+            .filter(Cell.sample_id == sample.id).count()
+        assert n_cells == 10, n_cells
+
+    # failure in a pipeline stage rolls back the whole sample
+    bad_cells = cells.astype({'CD45_1_Cell Masks': object})
+    bad_cells.loc[7, 'CD45_1_Cell Masks'] = 'not-a-number'
+    assert_raises(Exception, csess.add_sample_complex,
+                  {'name': 'pipelined_sample', 'tag': 'bad'},
+                  bad_cells, markers, chunksize=3, pipelined=True)
+    assert csess.get_sample(name='pipelined_sample', tag='bad') is None
+
+
+def test_cell_partition():
+    cells = pd.DataFrame({
+        "CellID": [1, 2],
+        "Area": [100.5, 80.0],
+        "CD45_1_Cell Masks": [1.0, 2.0],
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1],
+        "cycle_number": [1],
+        "marker_name": ['CD45']
+    })
+
+    csess.add_sample_complex({'name': 'partition_sample', 'tag': 'v1'},
+                             cells, markers)
+    sample = csess.get_sample(name='partition_sample', tag='v1')
+    assert csess.get_cell_partition_state(sample.id) == 'attached'
+    n_cells = csess.query(Cell.id) \
+        .filter(Cell.sample_id == sample.id).count()
+    assert n_cells == 2, n_cells
+
+    sample_id = sample.id
+    csess.delete_sample(name='partition_sample', tag='v1')
+    assert csess.get_cell_partition_state(sample_id) is None
+    n_cells = csess.query(Cell.id) \
+        .filter(Cell.sample_id == sample_id).count()
+    assert n_cells == 0, n_cells
+
+
+def test_cell_sample_cell_id_index():
+    cells = pd.DataFrame({
+        "CellID": list(range(1, 101)),
+        "Area": [100.5] * 100,
+        "CD45_1_Cell Masks": [float(x) for x in range(100)],
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1],
+        "cycle_number": [1],
+        "marker_name": ['CD45']
+    })
+    csess.add_sample_complex({'name': 'index_sample', 'tag': 'v1'},
+                             cells, markers)
+    sample = csess.get_sample(name='index_sample', tag='v1')
+
+    query = csess.query(Cell.id) \
+        .filter(Cell.sample_id == sample.id) \
+        .order_by(Cell.sample_cell_id)
+    sql = str(query.statement.compile(
+        bind=csess.get_bind(), compile_kwargs={'literal_binds': True}))
+    # the table is too small for the planner to prefer the index
+    csess.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = '\n'.join(x for x, in csess.execute(text('EXPLAIN ' + sql)))
+    csess.rollback()
+    assert 'Index Scan' in plan, plan
+    assert 'sample_id_sample_cell_id_idx' in plan, plan
+    assert 'Sort' not in plan, plan
+
+
+def test_sample_feature_manifest():
+    cells = pd.DataFrame({
+        "CellID": [1, 2],
+        "DAPI_1_Nuclei Masks": [1.0, 2.0],
+        "CD45_1_Cell Masks": [None, 2.0],
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1, 2],
+        "cycle_number": [1, 1],
+        "marker_name": ['DAPI', 'CD45']
+    })
+    csess.add_sample_complex({'name': 'manifest_sample', 'tag': 'v1'},
+                             cells, markers)
+
+    dapi = csess.marker_header_to_dbkey('DAPI_1_Nuclei Masks')
+    cd45 = csess.marker_header_to_dbkey('CD45_1_Cell Masks')
+    manifest = csess.get_sample_feature_manifest(
+        name='manifest_sample', tag='v1')
+    rval = [(x.position, x.db_key, x.marker_id, x.mask_type)
+            for x in manifest]
+    assert rval == [
+        (0, dapi, int(dapi[:-3]), 'nuclei_masks'),
+        (1, cd45, int(cd45[:-3]), 'cell_masks')], rval
+
+    keys = csess.get_sample_db_keys(name='manifest_sample', tag='v1')
+    assert sorted(keys) == sorted([dapi, cd45]), keys
+
+    csess.update_sample_feature_list({'name': 'manifest_sample',
+                                      'tag': 'v1'},
+                                     cells[['CellID', 'CD45_1_Cell Masks']])
+    keys = csess.get_sample_db_keys(name='manifest_sample', tag='v1')
+    assert keys == [cd45], keys
+
+
+def test_get_marker_map():
+    csess.clear_marker_map()
+    marker_map = csess.get_marker_map()
+    assert marker_map is csess.get_marker_map()
+    cd45 = csess.get_alias_marker_id('CD45')
+    assert marker_map[cd45].name == 'CD45', marker_map[cd45]
+
+    key = DB_Key(csess, '%d_cl' % cd45)
+    assert key.marker_comparator is \
+        csess.get_marker_comparator(cd45, fluor_sensitive=True)
+    assert key.to_header() == 'CD45__cell_masks', key.to_header()
+
+    # a new marker reloads the cache
+    marker_id = csess.add_marker({'name': 'CD_MAP_TEST'}).id
+    assert DB_Key(csess, '%d_nu' % marker_id).to_header() == \
+        'CD_MAP_TEST__nuclei_masks'
+    assert csess.get_marker_map() is not marker_map
+    csess.rollback()
+    csess.clear_marker_map()
+    assert_raises(ValueError, DB_Key, csess, '%d_nu' % marker_id)
+
+
+def test_get_cells_chunked():
+    sample = csess.get_sample(name='index_sample', tag='v1')
+    df = csess.get_cells_for_sample(sample)
+    chunks = list(csess.get_cells_for_sample(sample, chunksize=30))
+    assert [x.shape[0] for x in chunks] == [30, 30, 30, 10], chunks
+    pd.testing.assert_frame_equal(pd.concat(chunks), df)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cells.csv')
+        rval = csess.get_cells_from_samples([sample], to_path=path,
+                                            chunksize=30)
+        assert rval is None
+        pd.testing.assert_frame_equal(pd.read_csv(path, index_col=0),
+                                      pd.read_csv(StringIO(df.to_csv()),
+                                                  index_col=0))
+
+
+def test_get_cells_copy_exporter():
+    sample = csess.get_sample(name='copy_sample', tag='v1')
+    df = csess.get_cells_from_samples([sample])
+
+    buffer = StringIO()
+    rval = csess.get_cells_from_samples([sample], to_path=buffer,
+                                        exporter='copy')
+    assert rval is None
+    buffer.seek(0)
+    copied = pd.read_csv(buffer)
+    assert list(copied.columns) == list(df.columns), copied.columns
+    expected = pd.read_csv(StringIO(df.to_csv(index=False)))
+    pd.testing.assert_frame_equal(copied, expected)
+
+    assert_raises(ValueError, csess.get_cells_from_samples, [sample],
+                  exporter='copy')
+    assert_raises(ValueError, csess.get_cells_from_samples, [sample],
+                  to_path=buffer, exporter='unknown')
+
+
+def test_get_cells_to_parquet():
+    import pyarrow.dataset as ds
+
+    sample = csess.get_sample(name='index_sample', tag='v1')
+    df = csess.get_cells_for_sample(sample)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rval = csess.get_cells_for_sample(sample, to_parquet=tmp,
+                                          chunksize=30)
+        assert rval is None
+        table = ds.dataset(tmp, partitioning='hive').to_table()
+
+    assert table.num_rows == 100, table.num_rows
+    assert str(table.schema.field(df.columns[-1]).type) == 'float'
+    assert str(table.schema.field('area').type) == 'double'
+    rval = table.to_pandas()
+    assert (rval['sample_name'] == 'index_sample').all()
+    assert rval['sample_cell_id'].tolist() == list(range(1, 101))
+
+
+def test_get_cells_projection():
+    cells = pd.DataFrame({
+        "CellID": [1, 2, 3],
+        "Area": [100.5, 120.0, 90.25],
+        "X_centroid": [1.5, 2.5, 3.5],
+        "CD45_Cell Masks": [10.0, 20.0, 30.0],
+        "CD45_Nuclei Masks": [11.0, 21.0, 31.0],
+        "CD3_Cell Masks": [5.0, 6.0, 7.0],
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1, 2],
+        "cycle_number": [1, 1],
+        "marker_name": ['CD45', 'CD3']
+    })
+    csess.add_sample_complex({'name': 'projection_sample', 'tag': 'v1'},
+                             cells, markers)
+    sample = csess.get_sample(name='projection_sample', tag='v1')
+
+    assert csess.resolve_marker('cd-45').name == 'CD45'
+    assert csess.resolve_marker('CD 45').name == 'CD45'
+    assert_raises(ValueError, csess.resolve_marker, 'NO_SUCH_MARKER')
+
+    df = csess.get_cells_for_sample(sample, markers=['cd-45'],
+                                    features=['X_centroid'],
+                                    mask_types=['cell_masks'])
+    assert list(df.columns) == ['sample_name', 'sample_tag',
+                                'sample_cell_id', 'x_centroid',
+                                'CD45__cell_masks'], df.columns
+    assert df['CD45__cell_masks'].tolist() == [10.0, 20.0, 30.0]
+
+    df = csess.get_cells_from_samples([sample], features=[],
+                                      mask_types=['nu'])
+    assert list(df.columns) == ['sample_name', 'sample_tag',
+                                'sample_cell_id', 'CD45__nuclei_masks']
+
+    assert_raises(ValueError, csess.get_cells_for_sample, sample,
+                  mask_types=['whole_masks'])
+
+
+def test_get_cells_filters():
+    sample = csess.get_sample(name='projection_sample', tag='v1')
+
+    df = csess.get_cells_for_sample(
+        sample, filters='cd-45__cell_masks > 15 & Area < 110')
+    assert df['sample_cell_id'].tolist() == [3], df
+
+    df = csess.get_cells_from_samples(
+        [sample], filters=['CD3__cl <= 6 | CD45__nu > 30', '~(area > 110)'])
+    assert df['sample_cell_id'].tolist() == [1, 3], df
+
+    assert_raises(ValueError, csess.get_cells_for_sample, sample,
+                  filters='CD3__whole_masks > 1')
+    assert_raises(ValueError, csess.get_cells_for_sample, sample,
+                  filters='no_such_feature > 1')
+
+
+def test_summarize_samples():
+    sample = csess.get_sample(name='projection_sample', tag='v1')
+
+    df = csess.summarize_samples([sample], markers=['CD45'],
+                                 stats=['count', 'mean', 'max', 'p50'])
+    assert list(df.columns) == ['sample_name', 'sample_tag', 'marker',
+                                'count', 'mean', 'max', 'p50'], df.columns
+    assert df['marker'].tolist() == ['CD45__cell_masks',
+                                     'CD45__nuclei_masks'], df
+    assert df['count'].tolist() == [3, 3], df
+    assert df['mean'].tolist() == [20.0, 21.0], df
+    assert df['max'].tolist() == [30.0, 31.0], df
+    assert df['p50'].tolist() == [20.0, 21.0], df
+
+    df = csess.summarize_samples([sample], markers=['CD3'],
+                                 stats=['count', 'std'],
+                                 filters='area > 110')
+    assert df['count'].tolist() == [1], df
+    assert pd.isna(df['std'][0]), df
+
+    assert_raises(ValueError, csess.summarize_samples, [sample],
+                  stats=['mode'])
+
+
+def test_get_feature_stats():
+    sample = csess.get_sample(name='projection_sample', tag='v1')
+    cd45 = csess.resolve_marker('CD45').id
+
+    stats = csess.get_feature_stats([sample], markers=['CD45'],
+                                    mask_types=['cell_masks'])
+    assert list(stats) == [(sample.id, '%d_cl' % cd45)], stats
+    stats = stats[(sample.id, '%d_cl' % cd45)]
+    assert (stats.count, stats.min, stats.max) == (3, 10.0, 30.0)
+    assert stats.mean == 20.0 and stats.variance == 100.0
+    assert abs(stats.quantile(0.5) - 20.0) <= 0.2
+
+    # merged over samples
+    index_sample = csess.get_sample(name='index_sample', tag='v1')
+    stats = csess.get_feature_stats([sample, index_sample],
+                                    markers=['CD45'], merge=True)
+    assert stats['%d_cl' % cd45].count == 3
+    assert stats['%d_nu' % cd45].count == 3
+
+
+def test_get_cells_sampling():
+    sample = csess.get_sample(name='index_sample', tag='v1')
+
+    df = csess.get_cells_for_sample(sample, max_cells_per_sample=10,
+                                    seed=42)
+    assert df.shape[0] == 10, df
+    assert df['sample_cell_id'].is_monotonic_increasing
+    rval = csess.get_cells_from_samples([sample], max_cells_per_sample=10,
+                                        seed=42)
+    pd.testing.assert_frame_equal(rval, df)
+    # a smaller cap selects a subset
+    rval = csess.get_cells_for_sample(sample, max_cells_per_sample=5,
+                                      seed=42)
+    assert set(rval['sample_cell_id']) < set(df['sample_cell_id'])
+
+    df = csess.get_cells_for_sample(sample, sample_fraction=0.5, seed=1)
+    assert 20 < df.shape[0] < 80, df.shape
+    rval = csess.get_cells_for_sample(sample, sample_fraction=0.5, seed=1,
+                                      filters='CD45_1__cell_masks < 50')
+    assert set(rval['sample_cell_id']) == \
+        set(df['sample_cell_id'][df['sample_cell_id'] <= 50])
+
+    assert_raises(ValueError, csess.get_cells_for_sample, sample,
+                  sample_fraction=0)
+    assert_raises(ValueError, csess.get_cells_for_sample, sample,
+                  max_cells_per_sample=-1)
+
+
+def test_get_cells_in_region():
+    cells = pd.DataFrame({
+        "CellID": list(range(1, 101)),
+        "X_centroid": [float(x % 10) for x in range(100)],
+        "Y_centroid": [float(x // 10) for x in range(100)],
+        "CD45_Cell Masks": [float(x) for x in range(100)],
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1],
+        "cycle_number": [1],
+        "marker_name": ['CD45']
+    })
+    csess.add_sample_complex({'name': 'spatial_sample', 'tag': 'v1'},
+                             cells, markers)
+    sample = csess.get_sample(name='spatial_sample', tag='v1')
+    indexes = [x for x, in csess.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = :name"),
+        {'name': 'cell_sample_%d' % sample.id})]
+    assert 'cell_sample_%d_point_idx' % sample.id in indexes, indexes
+
+    df = csess.get_cells_in_bbox(sample, bbox=(2, 3, 4, 5))
+    assert df.columns.equals(csess.get_cells_for_sample(sample).columns)
+    assert df['sample_cell_id'].tolist() == [
+        33, 34, 35, 43, 44, 45, 53, 54, 55], df
+
+    df = csess.get_cells_in_radius(name='spatial_sample', tag='v1',
+                                   center=(5, 5), radius=1,
+                                   filters='CD45__cell_masks != 55')
+    assert df['sample_cell_id'].tolist() == [46, 55, 57, 66], df
+
+    assert_raises(ValueError, csess.get_cells_in_bbox, sample,
+                  bbox=(4, 0, 2, 1))
+    assert_raises(ValueError, csess.get_cells_for_sample, sample,
+                  center=(1, 1))
+
+
+def test_get_cells_sampling_by_sample():
+    samples = [csess.get_sample(name='index_sample', tag='v1'),
+               csess.get_sample(name='spatial_sample', tag='v1')]
+    df = csess.get_cells_from_samples(samples, marker_filter='union')
+    for sample in samples:
+        assert set(df['sample_cell_id'][df['sample_name'] == sample.name]) \
+            == set(range(1, 101))
+
+    # samples with the same cellIDs get different subsets
+    df = csess.get_cells_from_samples(samples, marker_filter='union',
+                                      max_cells_per_sample=10, seed=42)
+    subsets = [set(df['sample_cell_id'][df['sample_name'] == x.name])
+               for x in samples]
+    assert [len(x) for x in subsets] == [10, 10], subsets
+    assert subsets[0] != subsets[1], subsets
+
+
+def test_get_cells_parallel():
+    samples = [csess.get_sample(name='spatial_sample', tag='v1'),
+               csess.get_sample(name='index_sample', tag='v1')]
+    df = csess.get_cells_from_samples(samples, marker_filter='union',
+                                      filters='area > 50 | x_centroid < 5')
+    rval = csess.get_cells_from_samples(samples, marker_filter='union',
+                                        filters='area > 50 | x_centroid < 5',
+                                        workers=2)
+    assert rval['sample_name'].iloc[0] == 'index_sample'
+    pd.testing.assert_frame_equal(rval, df)
+
+    assert_raises(ValueError, csess.get_cells_from_samples, samples,
+                  workers=2, chunksize=10)
+    # sorted by the database collation, not by Python
+    for name in ('b', 'A'):
+        cells = pd.DataFrame({
+            "cellID": [1, 2],
+            "CD45_Cell Masks": [1.0, 2.0],
+        })
+        markers = pd.DataFrame({
+            "channel_number": [1],
+            "cycle_number": [1],
+            "marker_name": ['CD45']
+        })
+        csess.add_sample_complex({'name': name, 'tag': 'v1'}, cells,
+                                 markers)
+    cased = [csess.get_sample(name=x, tag='v1') for x in ('b', 'A')]
+    df = csess.get_cells_from_samples(cased)
+    pd.testing.assert_frame_equal(
+        csess.get_cells_from_samples(cased, workers=2), df)
+
+    # workers are capped by the pool
+    sess = CycSession(bind=engine_maker(url, pool_size=1, max_overflow=1))
+    try:
+        pd.testing.assert_frame_equal(
+            sess.get_cells_from_samples(cased, workers=8), df)
+    finally:
+        sess.close()
+        sess.get_bind().dispose()
+
+    for workers in (-1, 0, 1.5):
+        assert_raises(ValueError, csess.get_cells_from_samples, samples,
+                      workers=workers)
+    assert_raises(ValueError, csess.get_cells_from_samples, samples,
+                  workers=2, marker_dtype='float16')
+
+
+def test_resolve_samples():
+    index_sample = csess.get_sample(name='index_sample', tag='v1')
+    spatial_sample = csess.get_sample(name='spatial_sample', tag='v1')
+
+    rval = csess.resolve_samples([spatial_sample.id, index_sample.id])
+    assert rval == [spatial_sample, index_sample], rval
+    rval = csess.resolve_samples(names=['INDEX_sample', 'spatial_sample'],
+                                 tags=['V1', 'v1'])
+    assert rval == [index_sample, spatial_sample], rval
+
+    with assert_raises(ValueError) as cm:
+        csess.resolve_samples(names=['index_sample', 'no_such_sample'],
+                              tags=['v1'])
+    assert 'name=no_such_sample, tag=None' in str(cm.exception)
+    assert_raises(ValueError, csess.get_cells_from_samples,
+                  [index_sample.id, 2 ** 30])
+    rval = csess.resolve_samples([2 ** 30, index_sample.id],
+                                 ignore_missing=True)
+    assert rval == [index_sample], rval
+
+    rval = csess.get_samples_db_keys([index_sample, spatial_sample.id])
+    assert rval == {
+        index_sample.id: csess.get_sample_db_keys(index_sample),
+        spatial_sample.id: csess.get_sample_db_keys(spatial_sample)}, rval
+
+
+def test_iter_cells():
+    samples = [csess.get_sample(name='spatial_sample', tag='v1'),
+               csess.get_sample(name='index_sample', tag='v1')]
+    df = pd.concat([csess.get_cells_from_samples([x], marker_filter='union')
+                    for x in sorted(samples, key=lambda x: x.id)],
+                   ignore_index=True)
+
+    batches = list(csess.iter_cells(samples, batch_size=30,
+                                    marker_filter='union'))
+    assert [x.shape[0] for x in batches] == [30] * 6 + [20], batches
+    rval = pd.concat(batches, ignore_index=True)
+    assert list(rval.columns) == list(csess.get_cells_from_samples(
+        samples, marker_filter='union').columns)
+    pd.testing.assert_frame_equal(rval, df[rval.columns])
+
+    # resume after the 4th batch
+    rest = list(csess.iter_cells(samples, batch_size=30,
+                                 marker_filter='union',
+                                 cursor=batches[3].attrs['cursor']))
+    pd.testing.assert_frame_equal(pd.concat(rest, ignore_index=True),
+                                  pd.concat(batches[4:], ignore_index=True))
+
+    assert_raises(ValueError, csess.iter_cells, samples[:1],
+                  cursor=batches[3].attrs['cursor'])
+    assert_raises(ValueError, csess.iter_cells, samples, cursor='invalid')
+
+
+def test_iter_cells_null_and_duplicate_ids():
+    cells = pd.DataFrame({
+        "cellID": list(range(1, 11)),
+        "CD45_Cell Masks": [float(x) for x in range(1, 11)],
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1],
+        "cycle_number": [1],
+        "marker_name": ['CD45']
+    })
+    csess.add_sample_complex({'name': 'keyset_sample', 'tag': 'v1'},
+                             cells, markers)
+    sample = csess.get_sample(name='keyset_sample', tag='v1')
+    csess.execute(text(
+        "UPDATE cell SET sample_cell_id = CASE "
+        "WHEN sample_cell_id IN (3, 4, 5) THEN 3 "
+        "WHEN sample_cell_id > 7 THEN NULL ELSE sample_cell_id END "
+        "WHERE sample_id = :id"), {'id': sample.id})
+    csess.commit()
+
+    batches = list(csess.iter_cells([sample], batch_size=2))
+    assert [x.shape[0] for x in batches] == [2] * 5, batches
+    rval = pd.concat(batches, ignore_index=True)
+    assert sorted(rval['CD45__cell_masks']) == list(range(1, 11)), rval
+    assert rval['sample_cell_id'].tolist()[:7] == [1, 2, 3, 3, 3, 6, 7]
+    assert rval['sample_cell_id'].iloc[7:].isna().all()
+
+    # resume in the duplicates and in the NULLs
+    for i in (1, 3):
+        rest = list(csess.iter_cells([sample], batch_size=2,
+                                     cursor=batches[i].attrs['cursor']))
+        pd.testing.assert_frame_equal(
+            pd.concat(rest, ignore_index=True),
+            pd.concat(batches[i + 1:], ignore_index=True))
+
+
+def test_cells_cache():
+    cells = pd.DataFrame({
+        "cellID": [1, 2, 3],
+        "CD45_1_Cell Masks": [1.0, 2.0, 3.0],
+    })
+    markers = pd.DataFrame({
+        "channel_number": [1],
+        "cycle_number": [1],
+        "marker_name": ['CD45']
+    })
+    csess.add_sample_complex({'name': 'cache_sample', 'tag': 'v1'},
+                             cells, markers)
+    index_sample = csess.get_sample(name='index_sample', tag='v1')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = Cells_Cache(tmp)
+        sess = CycSession(bind=engine, cells_cache=cache)
+        try:
+            df = sess.get_cells_from_samples(names=['cache_sample'],
+                                             tags=['v1'])
+            other = sess.get_cells_from_samples([index_sample])
+            assert len(cache) == 2
+            pd.testing.assert_frame_equal(sess.get_cells_from_samples(
+                names=['cache_sample'], tags=['v1']), df)
+            pd.testing.assert_frame_equal(
+                sess.get_cells_from_samples([index_sample], workers=2), other)
+            assert len(cache) == 2
+
+            # sampling without seed isn't cached
+            sess.get_cells_from_samples([index_sample], sample_fraction=0.5)
+            assert len(cache) == 2
+
+            sess.delete_sample(name='cache_sample', tag='v1')
+            assert len(cache) == 1
+            pd.testing.assert_frame_equal(
+                cache.get(next(iter(cache._entries))), other)
+        finally:
+            sess.close()
+
+
+def test_matrix_cache():
+    sample = csess.get_sample(name='index_sample', tag='v1')
+    df = csess.get_cells_for_sample(sample, marker_dtype='float32')
+    df = df.astype({x: 'float32' for x in df.columns[3:]})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sess = CycSession(bind=engine, matrix_cache=Matrix_Cache(tmp))
+        try:
+            for _ in range(2):
+                rval = sess.get_cells_for_sample(sample.id,
+                                                 marker_dtype='float32')
+                pd.testing.assert_frame_equal(rval, df)
+            assert os.path.exists(os.path.join(tmp, 'sample_%d' % sample.id,
+                                               'manifest.json'))
+
+            rval = sess.get_cells_for_sample(sample.id, markers=['CD45'],
+                                             marker_dtype='float32')
+            assert list(rval.columns) == list(csess.get_cells_for_sample(
+                sample, markers=['CD45']).columns)
+            # not cached
+            rval = sess.get_cells_for_sample(sample.id)
+            assert rval['area'].dtype == 'float64'
+
+            # cells without `sample_cell_id` are never cached
+            keyset_sample = csess.get_sample(name='keyset_sample', tag='v1')
+            rval = sess.get_cells_for_sample(keyset_sample,
+                                             marker_dtype='float32')
+            assert rval.shape[0] == 10
+            assert rval['sample_cell_id'].isna().sum() == 3
+            assert not os.path.exists(os.path.join(
+                tmp, 'sample_%d' % keyset_sample.id))
+        finally:
+            sess.close()
+
+    # the queried cells are returned if the entry can't be mapped
+    class Broken_Cache(Matrix_Cache):
+        def load(self, sample_id, entry_at, db_keys):
+            return None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sess = CycSession(bind=engine, matrix_cache=Broken_Cache(tmp))
+        try:
+            pd.testing.assert_frame_equal(sess.get_cells_for_sample(
+                sample.id, marker_dtype='float32'), df)
+        finally:
+            sess.close()
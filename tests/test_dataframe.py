@@ -1,13 +1,22 @@
 import json
+import numpy as np
+import os
 import pandas as pd
 import tempfile
 
+from decimal import Decimal
+
 from nose.tools import assert_raises
 from cycif_db.data_frame import (
     CycDataFrame,
+    encode_features,
+    Feature_Stats,
     get_headers_categorized,
     header_to_marker,
-    MarkerIncompatibilityError)
+    MarkerIncompatibilityError,
+    Quantile_Sketch,
+    rows_to_frame,
+    write_parquet_dataset)
 
 
 data = {
@@ -54,3 +63,126 @@ def test_check_feature_compatibility():
     assert_raises(MarkerIncompatibilityError,
                   data_frame.check_feature_compatibility,
                   new_df, m_markers)
+
+
+def test_encode_features():
+    data = pd.DataFrame({
+        '1_cl': [15809.175, -0.5, 120, np.nan, 0.00004],
+        '2_nu': [17131.13756, 1e-4, -3, 2.5, 12345678.9]
+    })
+
+    rval = encode_features(data)
+    expected = data.round(4)
+    for i, text in enumerate(rval):
+        obs = json.loads(text)
+        for key, value in expected.iloc[i].items():
+            if np.isnan(value):
+                assert obs[key] is None, text
+            else:
+                assert obs[key] == value, text
+    assert list(rval.index) == list(data.index)
+
+    rval = encode_features(data, keys=['a', 'b'], decimals=0)
+    assert json.loads(rval[1]) == {'a': 0, 'b': 0}, rval[1]
+    assert json.loads(rval[2]) == {'a': 120, 'b': -3}, rval[2]
+    # compact, no padding from the wide values of other rows
+    assert rval[2] == '{"a":120,"b":-3}', rval[2]
+    assert rval[3] == '{"a":null,"b":2}', rval[3]
+
+    rval = encode_features(data.iloc[:0])
+    assert rval.empty, rval
+
+    assert_raises(ValueError, encode_features, data, keys=['a'])
+
+
+def test_write_parquet_dataset():
+    import pyarrow.parquet as pq
+
+    frames = [
+        pd.DataFrame({'sample_name': ['s1', 's1'],
+                      'sample_tag': ['v1', 'v1'],
+                      'sample_cell_id': [1, 2],
+                      'area': [Decimal('1.5000'), None],
+                      'CD45__cell_masks': [0.25, None]}),
+        pd.DataFrame({'sample_name': ['s1', 'a/b'],
+                      'sample_tag': ['v1', None],
+                      'sample_cell_id': [3, 1],
+                      'area': [Decimal('2.0000'), Decimal('3.0000')],
+                      'CD45__cell_masks': [1.0, 2.0]}, index=[2, 3]),
+    ]
+    dtypes = {'sample_cell_id': 'int64', 'CD45__cell_masks': 'float32'}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rval = write_parquet_dataset(frames, tmp,
+                                     ['sample_name', 'sample_tag'],
+                                     dtypes=dtypes)
+        assert rval == 4, rval
+
+        path = os.path.join(tmp, 'sample_name=s1', 'sample_tag=v1',
+                            'part-0.parquet')
+        pf = pq.ParquetFile(path)
+        assert pf.metadata.num_row_groups == 2, pf.metadata
+        table = pf.read()
+        assert table.column_names == \
+            ['sample_cell_id', 'area', 'CD45__cell_masks'], table.schema
+        assert str(table.schema.field('CD45__cell_masks').type) == 'float'
+        assert table.column('area').to_pylist() == [1.5, None, 2.0]
+
+        assert os.path.exists(os.path.join(
+            tmp, 'sample_name=a%2Fb', 'sample_tag=__HIVE_DEFAULT_PARTITION__',
+            'part-0.parquet'))
+
+
+def test_rows_to_frame():
+    rows = [('s1', 1, 1.5, 10.0), ('s1', 2, None, 20.0)]
+    columns = ['sample_name', 'sample_cell_id', '56_cl', 'area']
+    df = rows_to_frame(rows, columns,
+                       dtypes=[None, 'int64', 'float32', 'float64'])
+    assert list(df.columns) == columns
+    assert df['sample_cell_id'].dtype == np.int64
+    assert df['56_cl'].dtype == np.float32
+    assert np.isnan(df['56_cl'][1])
+    assert df['area'].dtype == np.float64
+    assert df['sample_name'].tolist() == ['s1', 's1']
+
+    # int column having NULLs falls back to float64
+    df = rows_to_frame([(1,), (None,)], ['x'], dtypes=['int64'])
+    assert df['x'].dtype == np.float64
+
+    df = rows_to_frame([], columns, dtypes=[None, 'int64', 'float32',
+                                            'float64'])
+    assert df.shape == (0, 4)
+    assert df['56_cl'].dtype == np.float32
+
+    assert_raises(ValueError, rows_to_frame, rows, columns, ['int64'])
+
+
+def test_feature_stats():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(8, 1, 10000)
+    values[::100] = np.nan
+    values[1::100] = 0
+    values[2::100] = -values[2::100]
+
+    stats = Feature_Stats()
+    for i in range(0, values.size, 3000):
+        stats.update(values[i: i + 3000])
+    expected = values[~np.isnan(values)]
+    assert stats.count == expected.size
+    assert stats.min == expected.min() and stats.max == expected.max()
+    assert np.isclose(stats.mean, expected.mean())
+    assert np.isclose(stats.variance, expected.var(ddof=1))
+    for q in (0, 0.01, 0.25, 0.5, 0.9, 1):
+        exact = np.quantile(expected, q, method='lower')
+        assert abs(stats.quantile(q) - exact) <= 0.01 * abs(exact) + 1e-9
+
+    # a merged sketch is the same as the sketch of all values
+    merged = Quantile_Sketch()
+    for chunk in np.array_split(values, 3):
+        sketch = Quantile_Sketch()
+        sketch.update(chunk)
+        merged.merge(Quantile_Sketch.from_dict(sketch.to_dict()))
+    assert merged.to_dict() == stats.sketch.to_dict()
+
+    assert Feature_Stats().variance is None
+    assert Quantile_Sketch().quantile(0.5) is None
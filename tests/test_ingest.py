@@ -0,0 +1,47 @@
+import json
+import pathlib
+import tempfile
+
+from nose.tools import assert_raises
+from cycif_db.ingest import (add_samples_from_dir, find_sample_complex,
+                             summarize_results)
+
+
+def test_find_sample_complex():
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = pathlib.Path(tmp, 'Sample1__v1')
+        folder.mkdir()
+        folder.joinpath('sample1_quant.csv').write_text('CellID\n1\n')
+        folder.joinpath('markers.csv').write_text('marker_name\nDAPI\n')
+        folder.joinpath('annotation.txt').write_text(
+            json.dumps({'tissue': 'breast'}))
+
+        sample, cells_path, markers_path = find_sample_complex(folder)
+
+        assert sample == {'name': 'Sample1', 'tag': 'v1',
+                          'annotation': {'tissue': 'breast'}}, sample
+        assert cells_path.endswith('sample1_quant.csv'), cells_path
+        assert markers_path.endswith('markers.csv'), markers_path
+
+        folder.joinpath('markers.csv').unlink()
+        assert_raises(Exception, find_sample_complex, folder)
+
+
+def test_add_samples_from_dir_failure_report():
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ('Sample2', 'Sample1'):
+            folder = pathlib.Path(tmp, name)
+            folder.mkdir()
+            folder.joinpath('quantification.csv').write_text('CellID\n1\n')
+
+        results = add_samples_from_dir(tmp, workers=2)
+
+    assert [pathlib.Path(x['folder']).name for x in results] == \
+        ['Sample1', 'Sample2'], results
+    assert not any(x['success'] for x in results), results
+    assert 'markers.csv' in results[0]['error'], results[0]['error']
+
+    report = summarize_results(results)
+    assert report.startswith("Added 0 of 2 samples, 2 failed."), report
+
+    assert_raises(ValueError, add_samples_from_dir, tmp, workers=0)
@@ -0,0 +1,24 @@
+from nose.tools import assert_raises
+from cycif_db.query import parse_filter
+
+
+def test_parse_filter():
+    rval = parse_filter('CD3__cell_masks > 500 & area < 200')
+    assert rval == ('and', ('cmp', '>', 'CD3__cell_masks', 500.0),
+                    ('cmp', '<', 'area', 200.0)), rval
+
+    # `&` binds tighter than `|`, and the number may come first
+    rval = parse_filter('a >= 1 | 2 > b and not c == -1e3')
+    assert rval == ('or', ('cmp', '>=', 'a', 1.0),
+                    ('and', ('cmp', '<', 'b', 2.0),
+                     ('not', ('cmp', '==', 'c', -1000.0)))), rval
+
+    rval = parse_filter('~(cd-45__cl != 0.5 | `14_3_3__nu` <= .5)')
+    assert rval == ('not', ('or', ('cmp', '!=', 'cd-45__cl', 0.5),
+                            ('cmp', '<=', '14_3_3__nu', 0.5))), rval
+
+
+def test_parse_filter_invalid():
+    for expr in ('area', 'area > ', 'area > b', '1 < 2', '(area > 1',
+                 'area > 1 )', 'area = 1', 'area > 1 $'):
+        assert_raises(ValueError, parse_filter, expr)
@@ -1,7 +1,40 @@
-from cycif_db.utils import get_configs
+from nose.tools import assert_raises
+from cycif_db.utils import get_configs, run_pipeline
 
 
 def test_get_configs():
     configs = get_configs()
     assert configs['auto_migrate'] is False
     # assert configs['db_url'] == 'sqlite:////tmp/db.sqlite'
+
+
+def test_run_pipeline():
+    rval = run_pipeline(range(10), lambda x: x * 2, lambda x: x + 1,
+                        queue_depth=1)
+    assert rval == [x * 2 + 1 for x in range(10)], rval
+
+    def source():
+        yield 1
+        raise KeyError('read')
+
+    assert_raises(KeyError, run_pipeline, source(), str, str)
+
+    def transform(x):
+        if x == 5:
+            raise ValueError('transform')
+        return x
+
+    assert_raises(ValueError, run_pipeline, range(100), transform, str)
+
+    consumed = []
+
+    def consume(x):
+        if x == 3:
+            raise TypeError('consume')
+        consumed.append(x)
+
+    assert_raises(TypeError, run_pipeline, range(100), int, consume)
+    assert consumed == [0, 1, 2], consumed
+
+    assert_raises(ValueError, run_pipeline, range(10), str, str,
+                  queue_depth=0)